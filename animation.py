@@ -0,0 +1,196 @@
+from collections import deque
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from PySide import QtCore
+
+
+# Durations at speed 1, in milliseconds: every transition holds for _PAUSE
+# and, if anything moves or changes color, animates over _MOVE after that.
+_PAUSE = 1000
+_MOVE = 1000
+_FRAME_INTERVAL = 16
+# Below this many moving nodes a frame is cheaper as a plain loop.
+_VECTOR_THRESHOLD = 64
+
+INSTANT = float('inf')
+
+
+class Transition(object):
+    # Takes a set of view nodes from one (slot, color, key) state to another.
+    # None stands for "not shown", so the same transition covers nodes that
+    # appear, disappear and move.
+
+    _changes = None
+    _moving = None
+    _fading = None
+    _starts = None
+    _deltas = None
+    _ratio = None
+
+    def __init__(self):
+        self._changes = {}
+
+    def add(self, node, old, new):
+        if old != new:
+            self._changes[id(node)] = (node, old, new)
+
+    def get_duration(self):
+        if any(old is not None and new is not None and old[:2] != new[:2]
+               for node, old, new in self._changes.values()):
+            return _PAUSE + _MOVE
+        return _PAUSE
+
+    def is_empty(self):
+        return not self._changes
+
+    def merge(self, other):
+        # Folds a later transition into this one: every node goes straight
+        # from where it was before this one to where it is after the other.
+        for key, (node, old, new) in other._changes.items():
+            if key in self._changes:
+                old = self._changes.pop(key)[1]
+            self.add(node, old, new)
+
+    def start(self):
+        # Packs the start points and the way to go of every moving node into
+        # one array, so a frame is a single multiply-add.
+        self._moving, self._fading = [], []
+        starts, ends = [], []
+        for node, old, new in self._changes.values():
+            if old is None:
+                node.show(new)
+            elif new is None:
+                node.hide()
+            else:
+                node.start_move(old, new)
+                motion = node.get_motion()
+                if motion is not None:
+                    self._moving.append(node)
+                    starts.append(motion[0])
+                    ends.append(motion[1])
+                if node.is_fading():
+                    self._fading.append(node)
+        if numpy is not None and len(starts) >= _VECTOR_THRESHOLD:
+            self._starts = numpy.array(starts, dtype=float)
+            self._deltas = numpy.array(ends, dtype=float) - self._starts
+        else:
+            self._starts = starts
+            self._deltas = [[b - a for a, b in zip(start, end)]
+                            for start, end in zip(starts, ends)]
+
+    def step(self, elapsed):
+        ratio = min(max(0.0, float(elapsed - _PAUSE) / _MOVE), 1.0)
+        if ratio == self._ratio:
+            return
+        self._ratio = ratio
+        if numpy is not None and isinstance(self._starts, numpy.ndarray):
+            frames = (self._starts + self._deltas * ratio).tolist()
+        else:
+            frames = [[a + d * ratio for a, d in zip(start, delta)]
+                      for start, delta in zip(self._starts, self._deltas)]
+        for node, frame in zip(self._moving, frames):
+            node.set_frame(*frame)
+        for node in self._fading:
+            node.fade(ratio)
+
+    def finish(self):
+        for node, old, new in self._changes.values():
+            if old is not None and new is not None:
+                node.finish_move()
+
+
+class RBTreeAnimator(QtCore.QObject):
+    # Plays transitions one after another off a QTimer, so the event loop
+    # never blocks. enqueue() may be called from any thread; the transitions
+    # themselves only ever run in the thread the animator lives in.
+
+    # Emitted after a timer tick that completed one or more transitions.
+    finished = QtCore.Signal()
+
+    _queued = QtCore.Signal(object)
+
+    _pending = None
+    _current = None
+    _elapsed = 0
+    _speed = 1.0
+    _max_backlog = 8
+
+    def __init__(self, parent=None):
+        super(RBTreeAnimator, self).__init__(parent)
+        self._pending = deque()
+        self._clock = QtCore.QElapsedTimer()
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(_FRAME_INTERVAL)
+        self._timer.timeout.connect(self._tick)
+        self._queued.connect(self._push)
+
+    def enqueue(self, transition):
+        if not transition.is_empty():
+            self._queued.emit(transition)
+
+    def get_speed(self):
+        return self._speed
+
+    def is_idle(self):
+        return self._current is None and not self._pending
+
+    def set_max_backlog(self, count):
+        # Once more than count transitions wait, they are merged into one
+        # so the animation catches up with the model.
+        self._max_backlog = count
+
+    def set_speed(self, speed):
+        # A multiplier of the default pace; INSTANT jumps to the end state.
+        self._speed = speed
+
+    def skip(self):
+        # Plays everything queued so far to its end at once.
+        self._advance(INSTANT)
+
+    ############################################################################
+
+    @QtCore.Slot(object)
+    def _push(self, transition):
+        self._pending.append(transition)
+        if not self._timer.isActive():
+            self._clock.start()
+            self._timer.start()
+            self._tick()
+
+    @QtCore.Slot()
+    def _tick(self):
+        budget = self._clock.restart()
+        self._advance(INSTANT if self._speed == INSTANT else budget * self._speed)
+
+    def _advance(self, budget):
+        finished = False
+        while True:
+            if self._current is None:
+                if not self._pending:
+                    self._timer.stop()
+                    break
+                self._start_next()
+            remaining = self._current.get_duration() - self._elapsed
+            if budget < remaining:
+                self._elapsed += budget
+                self._current.step(self._elapsed)
+                break
+            budget -= remaining
+            self._current.finish()
+            self._current = None
+            finished = True
+        if finished:
+            self.finished.emit()
+
+    def _start_next(self):
+        transition = self._pending.popleft()
+        if len(self._pending) >= self._max_backlog:
+            while self._pending:
+                transition.merge(self._pending.popleft())
+        transition.start()
+        self._current = transition
+        self._elapsed = 0
@@ -0,0 +1,404 @@
+import json
+import platform
+import sys
+from argparse import ArgumentParser
+from random import Random
+from timeit import default_timer
+
+from layout import SlotLayout, get_parent_slot, get_slot_coord, get_slot_coords
+from model import RBTreeModel
+from rbtree import RedBlackTree, RED, BLACK
+
+
+class RecursiveRedBlackTree(RedBlackTree):
+    # Reference copy of the former recursive engine, kept for comparison.
+
+    def _delete(self, node, key):
+        return self._delete_node(node, key), None
+
+    def _delete_node(self, node, key):
+        go_right = None
+        if node == key:
+            if node._left is not None:
+                go_right = False
+                node = self._make_left_red(node)
+            elif node._right is not None:
+                go_right = True
+                node = self._make_right_red(node)
+            else:
+                self._remove_node(node)
+                return None
+
+            if node == key:
+                if go_right:
+                    min_node = self._get_min(node._right)
+                    self._swap_nodes(node, min_node)
+                else:
+                    max_node = self._get_max(node._left)
+                    self._swap_nodes(node, max_node)
+            else:
+                go_right = None
+
+        if (go_right is not None and go_right) or (go_right is None and (node < key)):
+            node = self._make_right_red(node)
+            node._right = self._delete_node(node._right, key)
+        else:
+            node = self._make_left_red(node)
+            node._left = self._delete_node(node._left, key)
+
+        return self._local_balance(node)
+
+    def _insert(self, node, key):
+        return self._insert_node(node, key), None
+
+    def _insert_node(self, node, key):
+        if node is None:
+            return self._new_node(key, None)
+        if node == key:
+            return node
+        elif node < key:
+            node._right = self._insert_node(node._right, key)
+        else:
+            node._left = self._insert_node(node._left, key)
+        return self._local_balance(node)
+
+    def _search(self, node, key):
+        if node is None:
+            return False
+        elif node == key:
+            return node
+        elif node < key:
+            return self._search(node._right, key)
+        else:
+            return self._search(node._left, key)
+
+
+class TwoPassDeleteTree(RedBlackTree):
+    # Former delete path: a full search, then the top-down restructuring pass.
+
+    def _delete_key(self, key):
+        if not self.search(key):
+            return None
+        self._version += 1
+        if not(self._red(self._root._left) or self._red(self._root._right)):
+            self._root._color = RED
+        self._root, removed = self._delete(self._root, key)
+        if self._root:
+            self._root._color = BLACK
+        return removed
+
+
+def _time_ops(tree, operation, keys):
+    method = getattr(tree, operation)
+    start = default_timer()
+    for key in keys:
+        method(key)
+    return (default_timer() - start) / len(keys)
+
+
+################################################################################
+# Workloads
+
+
+def _sorted_keys(size, random):
+    return list(range(size))
+
+
+def _reversed_keys(size, random):
+    return list(range(size - 1, -1, -1))
+
+
+def _random_keys(size, random):
+    keys = list(range(size))
+    random.shuffle(keys)
+    return keys
+
+
+def _zigzag_keys(size, random):
+    # Alternates between both ends of the key range, so every insert lands on
+    # the outermost spine and every delete takes the longest rebalancing path.
+    keys = []
+    lo, hi = 0, size - 1
+    while lo <= hi:
+        keys.append(lo)
+        if lo != hi:
+            keys.append(hi)
+        lo, hi = lo + 1, hi - 1
+    return keys
+
+
+WORKLOADS = {
+    'sorted': _sorted_keys,
+    'reversed': _reversed_keys,
+    'random': _random_keys,
+    'zigzag': _zigzag_keys,
+}
+
+
+################################################################################
+# Targets
+
+
+def _model_with_hooks():
+    # Registers no-op observers everywhere RBTreeView and RBTreeController
+    # would, so the cost of hook dispatch is measured without any drawing.
+    def subscribe(node):
+        node.update_hooks(dict.fromkeys(
+            ('before_slot_changed', 'before_color_changed',
+             'before_key_changed', 'before_delete'), lambda: None))
+
+    def subscribe_all(nodes):
+        for node in nodes:
+            subscribe(node)
+
+    model = RBTreeModel()
+    model.update_hooks({
+        'after_tree_update': lambda: None,
+        'after_create_node': subscribe,
+        'after_create_nodes': subscribe_all,
+        'after_delete_node': lambda: None,
+    })
+    return model
+
+
+TREES = {
+    'rbtree': RedBlackTree,
+    'model': RBTreeModel,
+    'model+hooks': _model_with_hooks,
+}
+
+
+def bench_tree(factory, keys, probes, repeat):
+    timings = {}
+    for index in range(repeat):
+        tree = factory()
+        for operation, sequence in (('insert', keys), ('search', probes),
+                                    ('delete', keys)):
+            timing = _time_ops(tree, operation, sequence)
+            timings[operation] = min(timings.get(operation, timing), timing)
+    return timings
+
+
+def bench_layout(keys, repeat, width=1920.0):
+    tree = RBTreeModel()
+    tree.insert_many(keys)
+    tree.relayout()
+    slots = [node.get_slot() for node in tree._iter_nodes(tree._root)]
+
+    def slot_coord():
+        for slot in slots:
+            get_slot_coord(slot, width)
+            get_slot_coord(get_parent_slot(slot), width)
+
+    def slot_coords():
+        get_slot_coords(slots, width)
+
+    layout = SlotLayout(width)
+    layout.prepare(slots)
+
+    def cached_coord():
+        for slot in slots:
+            layout.get_coord(slot)
+
+    timings = {}
+    for name, function in (('slot_coord', slot_coord),
+                           ('slot_coords', slot_coords),
+                           ('cached_coord', cached_coord)):
+        for index in range(repeat):
+            start = default_timer()
+            function()
+            timing = (default_timer() - start) / len(slots)
+            timings[name] = min(timings.get(name, timing), timing)
+    return timings
+
+
+def run_suite(sizes, workloads=None, trees=None, repeat=3, seed=0):
+    results = []
+    for size in sizes:
+        for workload in sorted(workloads or WORKLOADS):
+            random = Random(seed)
+            keys = WORKLOADS[workload](size, random)
+            probes = _random_keys(size, random)
+            measured = []
+            for name in sorted(trees or TREES):
+                timings = bench_tree(TREES[name], keys, probes, repeat)
+                measured.extend((name, operation, timing)
+                                for operation, timing in timings.items())
+            measured.extend(('layout', operation, timing) for operation, timing
+                            in bench_layout(keys, repeat).items())
+            for name, operation, timing in sorted(measured):
+                results.append({
+                    'benchmark': '%s.%s' % (name, operation),
+                    'workload': workload,
+                    'size': size,
+                    'us_per_op': timing * 1e6,
+                })
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'results': results,
+    }
+
+
+def compare_results(baseline, current, tolerance):
+    # Returns (record, ratio) for every benchmark present in both runs and a
+    # list of the ones that got slower than the tolerance allows.
+    old = dict(((item['benchmark'], item['workload'], item['size']), item)
+               for item in baseline['results'])
+    compared, regressions = [], []
+    for item in current['results']:
+        previous = old.get((item['benchmark'], item['workload'], item['size']))
+        if previous is None:
+            continue
+        ratio = item['us_per_op'] / previous['us_per_op']
+        compared.append((item, ratio))
+        if ratio > 1 + tolerance:
+            regressions.append((item, ratio))
+    return compared, regressions
+
+
+################################################################################
+# Reference comparisons for past engine changes
+
+
+def compare_engines(size, seed=0):
+    keys = list(range(size))
+    Random(seed).shuffle(keys)
+    results = {}
+    for name, tree_class in (('recursive', RecursiveRedBlackTree),
+                             ('iterative', RedBlackTree)):
+        tree = tree_class()
+        results[name] = timings = {}
+        for operation in ('insert', 'search', 'delete'):
+            timings[operation] = _time_ops(tree, operation, keys)
+    return results
+
+
+def compare_delete(size, delete_ratio=0.7, miss_ratio=0.3, seed=0):
+    # Mixed workload on a tree of ``size`` keys: ``delete_ratio`` of the
+    # operations are deletes, ``miss_ratio`` of which target absent keys;
+    # the rest are inserts. Returns seconds per operation.
+    random = Random(seed)
+    operations = []
+    for index in range(size):
+        if random.random() < delete_ratio:
+            if random.random() < miss_ratio:
+                operations.append(('delete', size + random.randrange(size)))
+            else:
+                operations.append(('delete', random.randrange(size)))
+        else:
+            operations.append(('insert', random.randrange(2 * size)))
+    results = {}
+    for name, tree_class in (('two-pass', TwoPassDeleteTree),
+                             ('one-pass', RedBlackTree)):
+        tree = tree_class.from_sorted(range(size))
+        delete, insert = tree.delete, tree.insert
+        start = default_timer()
+        for operation, key in operations:
+            if operation == 'delete':
+                delete(key)
+            else:
+                insert(key)
+        results[name] = (default_timer() - start) / size
+    return results
+
+
+def compare_merge(size, other_size, seed=0):
+    # Merging a tree of ``other_size`` random keys into one of ``size``:
+    # insert by insert against union. Returns seconds for the whole merge.
+    random = Random(seed)
+    keys = sorted(random.sample(range(10 * size), size))
+    others = sorted(random.sample(range(10 * size), other_size))
+    results = {}
+    tree = RedBlackTree.from_sorted(keys)
+    start = default_timer()
+    tree.insert_many(others)
+    results['insert'] = default_timer() - start
+    tree, other = RedBlackTree.from_sorted(keys), RedBlackTree.from_sorted(others)
+    start = default_timer()
+    tree.union(other)
+    results['union'] = default_timer() - start
+    return results
+
+
+def bytes_per_node(tree_class):
+    tree = tree_class()
+    tree.insert(0)
+    node = tree._root
+    size = sys.getsizeof(node)
+    if hasattr(node, '__dict__'):
+        size += sys.getsizeof(node.__dict__)
+    return size
+
+
+def _reference_report(sizes):
+    for tree_class in (RedBlackTree, RBTreeModel):
+        sys.stdout.write('%s.Node: %d bytes\n'
+                         % (tree_class.__name__, bytes_per_node(tree_class)))
+    for size in sizes:
+        results = compare_engines(size)
+        for operation in ('insert', 'search', 'delete'):
+            old = results['recursive'][operation]
+            new = results['iterative'][operation]
+            sys.stdout.write('%8d %-7s recursive %7.2f us  iterative %7.2f us  x%.2f\n'
+                             % (size, operation, old * 1e6, new * 1e6, old / new))
+    for size in sizes:
+        results = compare_delete(size)
+        old, new = results['two-pass'], results['one-pass']
+        sys.stdout.write('%8d mixed   two-pass  %7.2f us  one-pass  %7.2f us  x%.2f\n'
+                         % (size, old * 1e6, new * 1e6, old / new))
+    for size in sizes:
+        for other_size in (size // 100, size // 10, size):
+            results = compare_merge(size, other_size)
+            old, new = results['insert'], results['union']
+            sys.stdout.write('%8d merge %-7d insert %8.2f ms  union %8.2f ms  x%.2f\n'
+                             % (size, other_size, old * 1e3, new * 1e3, old / new))
+
+
+def main(argv=None):
+    parser = ArgumentParser(description='Headless benchmarks for the tree, '
+                                        'the model and the layout math.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--workloads', nargs='+', choices=sorted(WORKLOADS))
+    parser.add_argument('--trees', nargs='+', choices=sorted(TREES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', metavar='FILE',
+                        help='write the results as JSON ("-" for stdout)')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='slowdown ratio above which a result counts as a '
+                             'regression (default: %(default)s)')
+    parser.add_argument('--reference', action='store_true',
+                        help='compare against the former engines instead')
+    args = parser.parse_args(argv)
+
+    if args.reference:
+        _reference_report(args.sizes)
+        return 0
+
+    current = run_suite(args.sizes, args.workloads, args.trees, args.repeat)
+    report = sys.stderr if args.json == '-' else sys.stdout
+    for item in current['results']:
+        report.write('%-22s %-9s %8d %10.3f us\n' % (
+            item['benchmark'], item['workload'], item['size'], item['us_per_op']))
+    if args.json == '-':
+        json.dump(current, sys.stdout, indent=2, sort_keys=True)
+    elif args.json:
+        with open(args.json, 'w') as stream:
+            json.dump(current, stream, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)
+        compared, regressions = compare_results(baseline, current, args.tolerance)
+        for item, ratio in regressions:
+            report.write('REGRESSION %-22s %-9s %8d x%.2f\n' % (
+                item['benchmark'], item['workload'], item['size'], ratio))
+        report.write('%d compared, %d regressions\n' % (len(compared), len(regressions)))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,19 @@
 from random import randint
 
+from PySide import QtCore
 
-class RBTreeController(object):
+
+class RBTreeController(QtCore.QObject):
+    # Runs the model in a worker thread of its own: the model hooks only
+    # queue transitions with the view, which plays them on the GUI thread.
 
     _gui = None
     _model = None
     _view = None
+    _thread = None
 
     def __init__(self, gui, model, view):
+        super(RBTreeController, self).__init__()
         self._gui = gui
         self._model = model
         self._view = view
@@ -15,34 +21,50 @@ class RBTreeController(object):
         self._model.update_hooks({
             'after_tree_update': self._after_tree_update,
             'after_create_node': self._after_create_node,
+            'after_create_nodes': self._after_create_nodes,
             'after_delete_node': self._after_delete_node,
         })
 
+        self._thread = QtCore.QThread()
+        self.moveToThread(self._thread)
+        app = QtCore.QCoreApplication.instance()
+        app.aboutToQuit.connect(self._thread.quit)
+        app.aboutToQuit.connect(self._thread.wait)
+        self._thread.start()
+
         self._gui.subscribe_add_node_event(self._add_node)
         self._gui.subscribe_delete_node_event(self._delete_node)
+        self._view.set_speed(
+            self._gui.subscribe_speed_changed_event(self._view.set_speed))
 
     ############################################################################
 
-    def _add_node(self, value, semaphore):
+    @QtCore.Slot(str, object)
+    def _add_node(self, value, done):
+        try:
+            try:
+                self._model.insert(int(value))
+            except ValueError:
+                num, lower, upper = map(int, value.split(','))
+                self._model.insert_many(randint(lower, upper) for i in range(num))
+        finally:
+            done()
+
+    @QtCore.Slot(str, object)
+    def _delete_node(self, value, done):
         try:
-            values = [int(value)]
-        except ValueError:
-            num, lower, upper = map(int, value.split(','))
-            values = [randint(lower, upper) for i in xrange(num)]
-        for index, item in enumerate(values):
-            self._model.insert(item)
-        semaphore.release()
-
-    def _delete_node(self, value, semaphore):
-        self._model.delete(int(value))
-        semaphore.release()
+            self._model.delete(int(value))
+        finally:
+            done()
 
     def _after_create_node(self, node):
         self._view.add_node(node)
 
+    def _after_create_nodes(self, nodes):
+        self._view.add_nodes(nodes)
+
     def _after_delete_node(self):
         self._view.delete_node()
 
     def _after_tree_update(self):
         self._view.visualize_changes()
-
@@ -2,6 +2,43 @@ from random import randint
 
 from PySide import QtCore, QtGui
 
+from animation import INSTANT
+
+
+_SPEEDS = (('0.25x', 0.25), ('0.5x', 0.5), ('1x', 1.0), ('2x', 2.0),
+           ('4x', 4.0), ('Instant', INSTANT))
+_DEFAULT_SPEED = 2
+
+_ZOOM_STEP = 1.25
+_MAX_ZOOM = 1 << 16
+
+
+class TreeGraphicsView(QtGui.QGraphicsView):
+    # Zooms with the mouse wheel around the cursor and pans by dragging.
+
+    viewChanged = QtCore.Signal()
+
+    def __init__(self, scene, parent=None):
+        super(TreeGraphicsView, self).__init__(scene, parent)
+        self.setDragMode(QtGui.QGraphicsView.ScrollHandDrag)
+        self.setTransformationAnchor(QtGui.QGraphicsView.AnchorUnderMouse)
+        self.horizontalScrollBar().valueChanged.connect(self._scrolled)
+        self.verticalScrollBar().valueChanged.connect(self._scrolled)
+
+    def resizeEvent(self, event):
+        super(TreeGraphicsView, self).resizeEvent(event)
+        self.viewChanged.emit()
+
+    def wheelEvent(self, event):
+        zoom = self.transform().m11()
+        factor = _ZOOM_STEP ** (event.delta() / 120.0)
+        factor = min(max(factor, 1.0 / zoom), _MAX_ZOOM / zoom)
+        self.scale(factor, factor)
+        self.viewChanged.emit()
+
+    def _scrolled(self, value):
+        self.viewChanged.emit()
+
 
 class MainWindow(QtGui.QDialog):
 
@@ -9,9 +46,15 @@ class MainWindow(QtGui.QDialog):
 
     _add_node_subscribers = None
     _delete_node_subscribers = None
+    _unfinished_edits = 0
 
-    _add_node_event = QtCore.Signal(str, QtCore.QSemaphore)
-    _delete_node_event = QtCore.Signal(str, QtCore.QSemaphore)
+    # Subscribers get the value and a callable to report completion with,
+    # which is safe to call from any thread.
+    _add_node_event = QtCore.Signal(str, object)
+    _delete_node_event = QtCore.Signal(str, object)
+    _edit_finished_event = QtCore.Signal()
+
+    _speed_changed_event = QtCore.Signal(float)
 
     _stop_mode_changed_event = QtCore.Signal(int)
 
@@ -28,9 +71,14 @@ class MainWindow(QtGui.QDialog):
         self.add_edit = QtGui.QLineEdit()
         self.delete_label = QtGui.QLabel('Delete node')
         self.delete_edit = QtGui.QLineEdit()
+        self.speed_label = QtGui.QLabel('Speed')
+        self.speed_combo = QtGui.QComboBox()
+        for text, speed in _SPEEDS:
+            self.speed_combo.addItem(text, speed)
+        self.speed_combo.setCurrentIndex(_DEFAULT_SPEED)
 
         self.canvas = QtGui.QGraphicsScene()
-        self.graph_view = QtGui.QGraphicsView(self.canvas)
+        self.graph_view = TreeGraphicsView(self.canvas)
         self.graph_view.setViewportUpdateMode(QtGui.QGraphicsView.FullViewportUpdate)
 
         ########################################################################
@@ -41,6 +89,8 @@ class MainWindow(QtGui.QDialog):
         top_layout.addWidget(self.add_edit)
         top_layout.addWidget(self.delete_label)
         top_layout.addWidget(self.delete_edit)
+        top_layout.addWidget(self.speed_label)
+        top_layout.addWidget(self.speed_combo)
 
         main_layout.addLayout(top_layout, 0, 0)
         main_layout.addWidget(self.graph_view, 1, 0)
@@ -50,6 +100,8 @@ class MainWindow(QtGui.QDialog):
 
         self.add_edit.returnPressed.connect(self._add_return_pressed)
         self.delete_edit.returnPressed.connect(self._delete_return_pressed)
+        self.speed_combo.currentIndexChanged.connect(self._speed_changed)
+        self._edit_finished_event.connect(self._edit_finished)
 
         ########################################################################
 
@@ -81,6 +133,10 @@ class MainWindow(QtGui.QDialog):
         self._delete_node_event.connect(slot)
         self._delete_node_subscribers += 1
 
+    def subscribe_speed_changed_event(self, slot):
+        self._speed_changed_event.connect(slot)
+        return self.speed_combo.itemData(self.speed_combo.currentIndex())
+
     def subscribe_stop_mode_changed_event(self, slot):
         self._stop_mode_changed_event.connect(slot)
         return self.stop_mode_group.checkedId()
@@ -100,18 +156,29 @@ class MainWindow(QtGui.QDialog):
         self.delete_edit.clear()
 
     def _edit_action(self, signal, value, subsribers_amount):
-        semaphore = QtCore.QSemaphore(subsribers_amount)
+        # Edits stay read-only until every subscriber has reported back, but
+        # the event loop keeps running meanwhile.
         self._set_edit_read_only(True)
-        semaphore.acquire(subsribers_amount)
-        signal.emit(value, semaphore)
-        semaphore.acquire(subsribers_amount)
-        self._clear_edit()
-        self._set_edit_read_only(False)
+        self._unfinished_edits = subsribers_amount
+        if subsribers_amount:
+            signal.emit(value, self._edit_finished_event.emit)
+        else:
+            self._edit_finished()
+
+    @QtCore.Slot()
+    def _edit_finished(self):
+        self._unfinished_edits = max(0, self._unfinished_edits - 1)
+        if not self._unfinished_edits:
+            self._clear_edit()
+            self._set_edit_read_only(False)
 
     def _set_edit_read_only(self, read_only):
         self.add_edit.setReadOnly(read_only)
         self.delete_edit.setReadOnly(read_only)
 
+    def _speed_changed(self, index):
+        self._speed_changed_event.emit(self.speed_combo.itemData(index))
+
     def _stop_mode_changed(self, button_id):
         self._stop_mode_changed_event.emit(button_id)
 
@@ -0,0 +1,148 @@
+from itertools import chain
+from math import ceil, floor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from rbtree import BLACK
+
+ROW_DISTANCE = 50
+
+# How RBTreeView and RBTreeRenderer draw a tree, in pixels on screen.
+CIRCLE_RADIUS = 12
+PEN_WEIGHT = 2
+# Rows whose slots are closer than this on screen are drawn as one glyph per
+# subtree instead of node by node.
+MIN_SPACING = CIRCLE_RADIUS * 2 + 4
+# Glyphs are narrower than their labels, which hang below the glyph row
+# instead, staggered over as many levels as it takes for labels on the same
+# level to be MIN_LABEL_WIDTH apart; past _MAX_LABEL_LEVELS glyphs go
+# without. GLYPH_LABEL_HEIGHT is the height of a level.
+MIN_LABEL_WIDTH = 48
+GLYPH_LABEL_HEIGHT = 32
+_MAX_LABEL_LEVELS = 4
+
+# Below this many slots a batch is cheaper as a plain loop than as arrays.
+_VECTOR_THRESHOLD = 64
+_LAYOUT_CACHE_SIZE = 4
+
+_layouts = {}
+
+
+class SlotLayout(object):
+    # Memoized slot -> scene coordinates for one canvas width.
+
+    _width = None
+    _coords = None
+
+    def __init__(self, width):
+        self._width = width
+        self._coords = {}
+
+    def get_coord(self, slot):
+        coord = self._coords.get(slot)
+        if coord is None:
+            coord = self._coords[slot] = get_slot_coord(slot, self._width)
+        return coord
+
+    def get_width(self):
+        return self._width
+
+    def prepare(self, slots):
+        # Computes every slot not cached yet in one batch.
+        missing = [slot for slot in set(slots) if slot not in self._coords]
+        self._coords.update(zip(missing, get_slot_coords(missing, self._width)))
+
+
+def get_detail_row(width, scale, spacing):
+    # First row whose neighbouring slots are less than ``spacing`` pixels
+    # apart on screen when the layout is drawn ``width`` wide at ``scale``.
+    row = 0
+    while width * scale >= spacing * (1 << row):
+        row += 1
+    return row
+
+
+def get_glyph_label(count, black_height):
+    return '%d\nbh %d' % (count, black_height)
+
+
+def get_glyph_shape(slot, width, scale=1.0):
+    # The triangle a glyph at slot is drawn as, spanning its subtree's share
+    # of the row below and hung from the parent like a node would be, and
+    # the top left corner of its label at ``scale``; None for the latter when
+    # the glyphs are too dense to be labelled.
+    row, col = slot
+    x, y = get_slot_coord(slot, width)
+    half = width / (2 << row)
+    points = ((x, y), (x - half, y + ROW_DISTANCE), (x + half, y + ROW_DISTANCE))
+    levels = int(ceil(MIN_LABEL_WIDTH / (2 * half * scale)))
+    if levels > _MAX_LABEL_LEVELS:
+        return points, None
+    return points, (x - half, y + ROW_DISTANCE +
+                    (col % levels) * GLYPH_LABEL_HEIGHT / float(scale))
+
+
+def get_layout(width):
+    # The SlotLayout for width, shared while only a few widths are in use.
+    layout = _layouts.get(width)
+    if layout is None:
+        if len(_layouts) >= _LAYOUT_CACHE_SIZE:
+            _layouts.clear()
+        layout = _layouts[width] = SlotLayout(width)
+    return layout
+
+
+def get_parent_slot(slot):
+    if slot is None or slot == (0, 0):
+        return None
+    return (slot[0] - 1, slot[1] >> 1)
+
+
+def get_row_span(row, width, left, right):
+    # First and last column of the slots in ``row`` with left <= x <= right;
+    # the slots of a row sit at width * (col + 0.5) / 2 ** row.
+    count = 1 << row
+    scale = float(count) / width
+    first = max(0, int(ceil(left * scale - 0.5)))
+    last = min(count - 1, int(floor(right * scale - 0.5)))
+    return first, last
+
+
+def get_slot_coord(slot, width):
+    # Each row splits the width into 2 ** row equal parts; a slot sits in the
+    # middle of its part. None is the point the root hangs from.
+    if slot is None:
+        return (width / 2.0, 0.0)
+    row, col = slot
+    return (width * (2 * col + 1) / float(2 << row), (row + 1.0) * ROW_DISTANCE)
+
+
+def get_slot_coords(slots, width):
+    # get_slot_coord for a whole sequence of slots, vectorized with NumPy
+    # when it is available.
+    if numpy is None or len(slots) < _VECTOR_THRESHOLD or None in slots:
+        return [get_slot_coord(slot, width) for slot in slots]
+    rows, cols = numpy.fromiter(chain.from_iterable(slots), dtype=float,
+                                count=2 * len(slots)).reshape(-1, 2).T
+    xs = width * (2 * cols + 1) / numpy.exp2(rows + 1)
+    ys = (rows + 1) * ROW_DISTANCE
+    return list(zip(xs.tolist(), ys.tolist()))
+
+
+def summarize(node, get_children):
+    # Node count and black height of the subtree under node, a glyph's
+    # label; get_children(node) is the (left, right) pair of node, None
+    # where there is no child. Nodes only need get_color().
+    black_height, left = 0, node
+    while left is not None:
+        black_height += left.get_color() == BLACK
+        left = get_children(left)[0]
+    count, stack = 0, [node]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(child for child in get_children(node) if child is not None)
+    return count, black_height
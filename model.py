@@ -1,117 +1,481 @@
+import json
 from sys import stderr
 
 from rbtree import RedBlackTree, RED, BLACK
 
 
+# Node attribute -> hook fired before it takes a different value.
+_ATTRIBUTE_HOOKS = {
+    '_slot': 'before_slot_changed',
+    '_color': 'before_color_changed',
+    '_key': 'before_key_changed',
+}
+
+
+class RBTreeTrace(object):
+    # Structural events recorded by RBTreeModel, in the order they happened.
+    # Every event is a tuple of plain values, (kind, node id, ...), so a trace
+    # round-trips through JSON; RBTreePlayer replays it. Nodes are named by
+    # ids handed out in creation order, since keys move between nodes.
+    #
+    #   ('reset', [(id, key, color, parent id, go_right), ...])  preorder
+    #   ('create', id, key, parent id, go_right)
+    #   ('delete', id)
+    #   ('rotate_left', id), ('rotate_right', id)
+    #   ('flip', id)
+    #   ('swap', id, id)
+    #   ('color', id, color)
+
+    _events = None
+    _ids = None
+    _next_id = 0
+
+    def __init__(self, events=()):
+        self._events = list(events)
+        self._ids = {}
+
+    def __iter__(self):
+        return iter(self._events)
+
+    def __len__(self):
+        return len(self._events)
+
+    @classmethod
+    def load(cls, stream):
+        return cls(tuple(event) for event in json.load(stream))
+
+    def dump(self, stream):
+        json.dump(self._events, stream, separators=(',', ':'))
+
+    def forget(self, node):
+        return self._ids.pop(id(node))
+
+    def get_id(self, node):
+        node_id = self._ids.get(id(node))
+        if node_id is None:
+            node_id = self._ids[id(node)] = self._next_id
+            self._next_id += 1
+        return node_id
+
+    def record(self, kind, *args):
+        self._events.append((kind,) + args)
+
+    def reset(self, root):
+        # Starts over from the tree under root, e.g. after a bulk load.
+        self._ids.clear()
+        nodes = []
+        stack = [(root, None, False)] if root is not None else []
+        while stack:
+            node, parent, go_right = stack.pop()
+            node_id = self.get_id(node)
+            nodes.append((node_id, node._key, node._color, parent, go_right))
+            if node._right is not None:
+                stack.append((node._right, node_id, True))
+            if node._left is not None:
+                stack.append((node._left, node_id, False))
+        self.record('reset', nodes)
+
+
 class RBTreeModel(RedBlackTree):
 
     _hooks = None
-    _slot_stack = None
+    _batch = None
+    _moved = None
+    _stale = False
+    _trace = None
+
+    # Overrides that only keep slots current, notify observers and record the
+    # trace. While the model has no observers and records nothing, the
+    # instance shadows them with the plain RedBlackTree methods, so a headless
+    # model runs the bare engine and lays itself out only when relayout() is
+    # called.
+    _OBSERVED_METHODS = (
+        'delete', 'delete_many', 'difference', 'insert', 'insert_many',
+        'intersection', 'join', 'split', 'union', '_delete', '_insert',
+        '_balance_path', '_new_node', '_remove_node', '_unlink',
+        '_flip_color', '_rotate_left', '_rotate_right', '_swap_nodes',
+    )
 
 
     class Node(RedBlackTree.Node):
-        _slot = None
-        _hooks = None
+        __slots__ = ('_slot', '_hooks')
 
         def __init__(self, key):
-            self._hooks = {}
-            super(type(self), self).__init__(key)
-
-        def __setattr__(self, key, value):
-            if key == '_slot' and self._slot != value:
-                self._hooks.get('before_slot_changed', lambda: False)()
-            if key == '_color' and self._color != value:
-                self._hooks.get('before_color_changed', lambda: False)()
-            if key == '_key' and self._key != value:
-                self._hooks.get('before_key_changed', lambda: False)()
-            return super(type(self), self).__setattr__(key, value)
+            self._hooks = None
+            self._slot = None
+            super(RBTreeModel.Node, self).__init__(key)
 
         def delete(self):
-            self._hooks.get('before_delete', lambda: False)()
+            hook = self._hooks.get('before_delete') if self._hooks else None
+            if hook is not None:
+                hook()
 
         def get_slot(self):
             return self._slot
 
-        def set_slot(self, slot):
-            self._slot = slot
-            row, col = slot
-            if self._left:
-                self._left.set_slot((row + 1, col * 2))
-            if self._right:
-                self._right.set_slot((row + 1, col * 2 + 1))
+        def remove_hooks(self, names):
+            if self._hooks:
+                for name in names:
+                    self._hooks.pop(name, None)
+            if not self._hooks:
+                self.__class__ = RBTreeModel.Node
 
         def update_hooks(self, hooks):
+            if self._hooks is None:
+                self._hooks = {}
             self._hooks.update(hooks)
+            if self._hooks:
+                self.__class__ = RBTreeModel.ObservedNode
+
+    class ObservedNode(Node):
+        # Same layout as Node; a node is switched to this class only while it
+        # has hooks, so writes to every other node stay plain slot stores.
+        __slots__ = ()
+
+        def __setattr__(self, key, value):
+            hook = self._hooks.get(_ATTRIBUTE_HOOKS.get(key))
+            if hook is not None and getattr(self, key) != value:
+                hook()
+            super(RBTreeModel.ObservedNode, self).__setattr__(key, value)
 
     ############################################################################
 
     def __init__(self):
         super(RBTreeModel, self).__init__()
         self._hooks = {}
-        self._slot_stack = []
+        self._moved = []
+        self._update_observers()
+
+    def get_moved_nodes(self):
+        # Nodes whose slot changed since the previous after_tree_update; valid
+        # while that hook runs.
+        return self._moved
+
+    def relayout(self):
+        # Brings every slot up to date. Slots are only maintained while the
+        # model has observers; without any, each call lays out the whole tree.
+        if self._stale:
+            self._stale = not self._hooks
+            del self._moved[:]
+            if self._root is not None:
+                self._relayout(self._root, (0, 0), None)
+
+    def remove_hooks(self, names):
+        for name in names:
+            self._hooks.pop(name, None)
+        self._update_observers()
+
+    def start_trace(self):
+        # Records every structural change from now on, starting with a
+        # snapshot of the current tree. Recording alone keeps the model
+        # headless: no slots are computed and no hooks are called.
+        self._trace = RBTreeTrace()
+        self._trace.reset(self._root)
+        self._update_observers()
+        return self._trace
+
+    def stop_trace(self):
+        trace, self._trace = self._trace, None
+        self._update_observers()
+        return trace
 
     def update_hooks(self, hooks):
         self._hooks.update(hooks)
+        self._update_observers()
 
     ############################################################################
 
+    def bulk_load(self, keys):
+        old_nodes = list(self._iter_nodes(self._root))
+        super(RBTreeModel, self).bulk_load(keys)
+        if self._trace is not None:
+            self._trace.reset(self._root)
+        self._after_load(old_nodes)
+
     def delete(self, key):
-        super(RBTreeModel, self).delete(key)
-        if self._root:
-            self._root.set_slot((0, 0))
-        self._hooks.get('after_tree_update', lambda: False)()
+        removed = super(RBTreeModel, self).delete(key)
+        self._after_tree_update()
+        return removed
+
+    def delete_many(self, keys):
+        self._begin_batch()
+        try:
+            super(RBTreeModel, self).delete_many(keys)
+        finally:
+            self._end_batch()
+
+    def difference(self, other):
+        self._reload((), super(RBTreeModel, self).difference, other)
 
     def insert(self, key):
-        self._slot_stack = [(0, 0)]
         super(RBTreeModel, self).insert(key)
-        self._hooks.get('after_tree_update', lambda: False)()
-        self._slot_stack.pop()
+        self._after_tree_update()
+
+    def insert_many(self, keys):
+        self._begin_batch()
+        try:
+            super(RBTreeModel, self).insert_many(keys)
+        finally:
+            self._end_batch()
+
+    def intersection(self, other):
+        self._reload((), super(RBTreeModel, self).intersection, other)
+
+    def join(self, key, other):
+        # Checked up front: a join that fails must not detach other.
+        sort_key = self._check_join(key, other)
+        self._reload((other,), self._join_trees, key, sort_key, other)
+
+    def split(self, key):
+        return self._reload((), super(RBTreeModel, self).split, key)
+
+    def union(self, other):
+        self._reload((), super(RBTreeModel, self).union, other)
+
+    ############################################################################
+
+    def _adopt(self, root, count):
+        old_nodes = list(self._iter_nodes(self._root))
+        super(RBTreeModel, self)._adopt(root, count)
+        if self._trace is not None:
+            self._trace.reset(self._root)
+        self._after_load(old_nodes)
+
+    def _after_load(self, old_nodes):
+        # Reports a wholesale replacement of the nodes.
+        if old_nodes:
+            for node in old_nodes:
+                node.delete()
+            self._notify('after_delete_node')
+        self._stale = True
+        self.relayout()
+        if self._root:
+            self._notify('after_create_nodes', list(self._iter_nodes(self._root)))
+        self._after_tree_update()
+
+    def _reload(self, consumed, operation, *args):
+        # Runs a join-based operation on the bare engine -- it relinks whole
+        # subtrees, which no hook or trace event describes -- and reports the
+        # outcome as a reload, like bulk_load does. The observers of a model
+        # in consumed, whose nodes the operation takes over, see all of them
+        # go first; nodes that end up in no observed tree lose their hooks.
+        others = [tree for tree in consumed if isinstance(tree, RBTreeModel)]
+        for other in others:
+            other._detach()
+        old_nodes = list(self._iter_nodes(self._root))
+        hooks, trace = self._hooks, self._trace
+        self._hooks, self._trace = {}, None
+        self._update_observers()
+        try:
+            result = operation(*args)
+        finally:
+            self._hooks, self._trace = hooks, trace
+            self._update_observers()
+        for tree in [self] + others:
+            if tree._trace is not None:
+                tree._trace.reset(tree._root)
+        self._after_load(old_nodes)
+        kept = set(map(id, self._iter_nodes(self._root)))
+        for node in old_nodes:
+            if id(node) not in kept:
+                node.remove_hooks(list(node._hooks or ()))
+        return result
+
+    def _detach(self):
+        # Reports every node as deleted and strips their hooks, ahead of
+        # another model taking them over.
+        nodes = list(self._iter_nodes(self._root))
+        if nodes:
+            for node in nodes:
+                node.delete()
+                node.remove_hooks(list(node._hooks or ()))
+            self._notify('after_delete_node')
+            self._after_tree_update()
+
+    def _notify(self, name, *args):
+        hook = self._hooks.get(name)
+        if hook is not None:
+            hook(*args)
+
+    def _record(self, kind, *nodes):
+        if self._trace is not None:
+            self._trace.record(kind, *[self._trace.get_id(node) for node in nodes])
+
+    def _record_color(self, node, color):
+        # For colors the engine assigns directly rather than through
+        # _flip_color or a rotation: those of the root.
+        if self._trace is not None:
+            self._trace.record('color', self._trace.get_id(node), color)
+
+    def _update_observers(self):
+        # Stats wrap whatever methods the instance shadows, so they come off
+        # first and go back on top.
+        if self._stats is not None:
+            self._stats.uninstall(self)
+        if self._hooks or self._trace is not None:
+            for name in self._OBSERVED_METHODS:
+                self.__dict__.pop(name, None)
+        else:
+            for name in self._OBSERVED_METHODS:
+                setattr(self, name, getattr(super(RBTreeModel, self), name))
+        if self._stats is not None:
+            self._stats.install(self)
+        if self._hooks:
+            self.relayout()
+        else:
+            self._stale = True
 
     ############################################################################
 
     def _delete(self, node, key):
-        new_node = super(RBTreeModel, self)._delete(node, key)
-        if new_node is None:
-            node.delete()
-            self._hooks.get('after_delete_node', lambda: False)()
-        return new_node
+        if node._color == RED:
+            self._record_color(node, RED)
+        root, removed = super(RBTreeModel, self)._delete(node, key)
+        if root is not None and root._color == RED:
+            self._record_color(root, BLACK)
+        return root, removed
 
     def _insert(self, node, key):
-        if node:
-            row, col = self._slot_stack[-1]
-            if node < key:
-                self._slot_stack.append((row + 1, col * 2 + 1))
+        root, node = super(RBTreeModel, self)._insert(node, key)
+        if root._color == RED:
+            self._record_color(root, BLACK)
+        return root, node
+
+    ############################################################################
+
+    def _new_node(self, key, path):
+        node = super(RBTreeModel, self)._new_node(key, path)
+        trace = self._trace
+        if trace is not None:
+            parent, go_right = path[-1] if path else (None, False)
+            parent = trace.get_id(parent) if parent is not None else None
+            trace.record('create', trace.get_id(node), key, parent, go_right)
+        if self._batch is not None:
+            # Left without a slot; the relayout at the end of the batch
+            # places it together with everything else that moved.
+            self._batch['created'][id(node)] = node
+            return node
+        if not self._stale:
+            if path:
+                parent, go_right = path[-1]
+                row, col = parent.get_slot()
+                node._slot = (row + 1, col * 2 + int(go_right))
             else:
-                self._slot_stack.append((row + 1, col * 2))
-        new_node = super(RBTreeModel, self)._insert(node, key)
-        if node:
-            self._slot_stack.pop()
-        else:
-            new_node.set_slot(self._slot_stack[-1])
-            self._hooks.get('after_create_node', lambda x: False)(new_node)
-        return new_node
+                node._slot = (0, 0)
+        self._notify('after_create_node', node)
+        return node
+
+    def _remove_node(self, node):
+        super(RBTreeModel, self)._remove_node(node)
+        if self._trace is not None:
+            self._trace.record('delete', self._trace.forget(node))
+        node.delete()
+        if self._batch is None:
+            self._notify('after_delete_node')
+        elif self._batch['created'].pop(id(node), None) is None:
+            self._batch['removed'] = True
+
+    ############################################################################
+
+    def _unlink(self, path, leaf):
+        self._mark_dirty(path)
+        super(RBTreeModel, self)._unlink(path, leaf)
+
+    ############################################################################
+    # Slots are kept current eagerly outside of batches: a rotation relays out
+    # just the subtree it turned, which is exactly the set of nodes that
+    # moved. Inside a batch every node whose links change is marked dirty
+    # instead -- and with it all its ancestors, since changes only ever happen
+    # along a descent path -- and a single pass from the root at the end
+    # skips every subtree that neither moved nor was restructured.
+
+    def _balance_path(self, path, node):
+        if self._batch is not None:
+            self._mark_dirty(parent for parent, go_right in path)
+        return super(RBTreeModel, self)._balance_path(path, node)
+
+    def _mark_dirty(self, nodes):
+        if self._batch is not None:
+            dirty = self._batch['dirty']
+            for node in nodes:
+                dirty[id(node)] = node
+
+    def _relayout(self, node, slot, dirty):
+        # Without a dirty set every subtree is visited.
+        moved = self._moved
+        stack = [(node, slot)]
+        while stack:
+            node, slot = stack.pop()
+            if node._slot != slot:
+                if node._slot is not None:
+                    moved.append(node)
+                node._slot = slot
+            elif dirty is not None and id(node) not in dirty:
+                continue
+            row, col = slot
+            if node._left is not None:
+                stack.append((node._left, (row + 1, col * 2)))
+            if node._right is not None:
+                stack.append((node._right, (row + 1, col * 2 + 1)))
+
+    ############################################################################
+
+    def _begin_batch(self):
+        if self._batch is None:
+            self._batch = {'created': {}, 'dirty': {}, 'removed': False,
+                           'depth': 0}
+        self._batch['depth'] += 1
+
+    def _end_batch(self):
+        # Nodes that were created and removed within the same batch are never
+        # reported; everything else is reported once, as a single change set.
+        self._batch['depth'] -= 1
+        if self._batch['depth']:
+            return
+        if self._root is not None and not self._stale:
+            self._relayout(self._root, (0, 0), self._batch['dirty'])
+        batch, self._batch = self._batch, None
+        if batch['removed']:
+            self._notify('after_delete_node')
+        if batch['created']:
+            self._notify('after_create_nodes', list(batch['created'].values()))
+        self._after_tree_update()
+
+    def _after_tree_update(self):
+        if self._batch is None:
+            self._notify('after_tree_update')
+            del self._moved[:]
 
     ############################################################################
 
     def _flip_color(self, node):
         super(RBTreeModel, self)._flip_color(node)
-        self._hooks.get('after_tree_update', lambda: False)()
+        self._record('flip', node)
+        self._after_tree_update()
 
     def _rotate_left(self, node):
         slot = node.get_slot()
-        node = super(RBTreeModel, self)._rotate_left(node)
-        node.set_slot(slot)
-        self._hooks.get('after_tree_update', lambda: False)()
-        return node
+        top = super(RBTreeModel, self)._rotate_left(node)
+        self._record('rotate_left', node)
+        if self._batch is not None:
+            self._mark_dirty((node, top))
+        elif not self._stale:
+            self._relayout(top, slot, None)
+        self._after_tree_update()
+        return top
 
     def _rotate_right(self, node):
         slot = node.get_slot()
-        node = super(RBTreeModel, self)._rotate_right(node)
-        node.set_slot(slot)
-        self._hooks.get('after_tree_update', lambda: False)()
-        return node
+        top = super(RBTreeModel, self)._rotate_right(node)
+        self._record('rotate_right', node)
+        if self._batch is not None:
+            self._mark_dirty((node, top))
+        elif not self._stale:
+            self._relayout(top, slot, None)
+        self._after_tree_update()
+        return top
 
     def _swap_nodes(self, a, b):
         super(RBTreeModel, self)._swap_nodes(a, b)
-        self._hooks.get('after_tree_update', lambda: False)()
-
+        self._record('swap', a, b)
+        self._after_tree_update()
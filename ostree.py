@@ -0,0 +1,118 @@
+from rbtree import RedBlackTree, RED
+
+
+class OrderStatisticTree(RedBlackTree):
+
+    class Node(RedBlackTree.Node):
+        __slots__ = ('_size',)
+
+        def __init__(self, key):
+            super(OrderStatisticTree.Node, self).__init__(key)
+            self._size = 1
+
+        def get_size(self):
+            return self._size
+
+    class KeyedNode(Node):
+        __slots__ = ('_item',)
+
+        def get_item(self):
+            return self._item
+
+    ############################################################################
+
+    def count_range(self, lo, hi):
+        if self._key_func is not None:
+            lo, hi = self._key_func(lo), self._key_func(hi)
+        if hi < lo:
+            return 0
+        return self._rank(hi, True) - self._rank(lo, False)
+
+    def rank(self, key):
+        if self._key_func is not None:
+            key = self._key_func(key)
+        return self._rank(key, False)
+
+    def select(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('index out of range')
+        node = self._root
+        while True:
+            left_size = node._left._size if node._left is not None else 0
+            if index < left_size:
+                node = node._left
+            elif index > left_size:
+                index -= left_size + 1
+                node = node._right
+            else:
+                return self._get_item(node)
+
+    ############################################################################
+
+    def _adopt(self, root, count):
+        super(OrderStatisticTree, self)._adopt(root, count)
+        self._update_sizes()
+
+    def _build(self, nodes, lo, hi, height):
+        node = super(OrderStatisticTree, self)._build(nodes, lo, hi, height)
+        if node is not None:
+            if node._left is not None and node._left._color == RED:
+                self._update_size(node._left)
+            self._update_size(node)
+        return node
+
+    def _rank(self, key, inclusive):
+        node, rank = self._root, 0
+        while node is not None:
+            node_key = node._key
+            if node_key < key or (inclusive and node_key == key):
+                rank += 1 + (node._left._size if node._left is not None else 0)
+                node = node._right
+            else:
+                node = node._left
+        return rank
+
+    def _check_node(self, node, lo, hi, path):
+        super(OrderStatisticTree, self)._check_node(node, lo, hi, path)
+        size = (1 + (node._left._size if node._left is not None else 0) +
+                (node._right._size if node._right is not None else 0))
+        if node._size != size:
+            self._fail('size %d instead of %d' % (node._size, size), path)
+
+    def _count_apart(self, a, b, total):
+        return (a._size if a is not None else 0), (b._size if b is not None else 0)
+
+    def _unlink(self, path, leaf):
+        super(OrderStatisticTree, self)._unlink(path, leaf)
+        for node in path:
+            node._size -= 1
+
+    def _update_size(self, node):
+        node._size = (1 + (node._left._size if node._left is not None else 0) +
+                      (node._right._size if node._right is not None else 0))
+
+    def _update_sizes(self):
+        # Children always come after their parent in preorder, so walking it
+        # backwards sizes every subtree before the node above it.
+        for node in reversed(list(self._iter_nodes(self._root))):
+            self._update_size(node)
+
+    ############################################################################
+
+    def _local_balance(self, node):
+        self._update_size(node)
+        return super(OrderStatisticTree, self)._local_balance(node)
+
+    def _rotate_left(self, node):
+        top = super(OrderStatisticTree, self)._rotate_left(node)
+        top._size = node._size
+        self._update_size(node)
+        return top
+
+    def _rotate_right(self, node):
+        top = super(OrderStatisticTree, self)._rotate_right(node)
+        top._size = node._size
+        self._update_size(node)
+        return top
@@ -0,0 +1,157 @@
+from itertools import count
+
+from rbtree import RedBlackTree, RED, BLACK
+
+
+# Every tree and every snapshot writes in an epoch of its own.
+_epochs = count(1)
+
+
+class PersistentRedBlackTree(RedBlackTree):
+    # A tree whose nodes are never changed once another version can see
+    # them. Each node is stamped with the epoch of the version that made it;
+    # a version only ever writes to nodes of its own epoch and copies any
+    # other node first, which in turn rewrites the link to it from a parent
+    # that is copied the same way. An insert or delete thus copies the
+    # O(log n) nodes it touches, and snapshot() only has to hand out the root
+    # and move both versions to new epochs.
+    #
+    # A snapshot is a tree like any other. Readers may search and scan it
+    # from any thread while the tree it was taken from keeps changing.
+
+    _epoch = 0
+
+    class Node(RedBlackTree.Node):
+        __slots__ = ('_epoch',)
+
+        def __init__(self, key):
+            super(PersistentRedBlackTree.Node, self).__init__(key)
+            self._epoch = 0
+
+    class KeyedNode(Node):
+        __slots__ = ('_item',)
+
+        def get_item(self):
+            return self._item
+
+    ############################################################################
+
+    def __init__(self, key=None):
+        super(PersistentRedBlackTree, self).__init__(key=key)
+        self._epoch = next(_epochs)
+
+    def bulk_load(self, keys):
+        super(PersistentRedBlackTree, self).bulk_load(keys)
+        for node in self._iter_nodes(self._root):
+            node._epoch = self._epoch
+
+    def snapshot(self):
+        # Returns a tree holding the current contents in O(1). Neither tree
+        # sees later changes to the other.
+        tree = self._new_tree()
+        tree._root = self._root
+        tree._count = self._count
+        self._epoch = next(_epochs)
+        self._version += 1
+        return tree
+
+    ############################################################################
+
+    def _delete_key(self, key):
+        # The base class cuts red leaves off in place; here every delete goes
+        # top-down, where each node is copied before it is changed.
+        if not self._search(self._root, key):
+            return None
+        self._version += 1
+        root = self._own(self._root)
+        if not(self._red(root._left) or self._red(root._right)):
+            root._color = RED
+        self._root, removed = self._delete(root, key)
+        if self._root is not None:
+            self._root._color = BLACK
+        return removed
+
+    def _copy_node(self, node):
+        copy = super(PersistentRedBlackTree, self)._copy_node(node)
+        copy._epoch = self._epoch
+        return copy
+
+    def _new_node(self, key, path):
+        node = super(PersistentRedBlackTree, self)._new_node(key, path)
+        node._epoch = self._epoch
+        return node
+
+    def _own(self, node):
+        # node itself if this version may write to it, else a copy that it
+        # may write to; the caller links the copy in place of node.
+        if node._epoch == self._epoch:
+            return node
+        copy = object.__new__(node.__class__)
+        copy._key = node._key
+        copy._color = node._color
+        copy._left = node._left
+        copy._right = node._right
+        copy._epoch = self._epoch
+        if self._key_func is not None:
+            copy._item = node._item
+        return copy
+
+    ############################################################################
+    # Every method below writes to some nodes; they take ownership first.
+
+    def _add_leaf(self, root, height, leaf, copy=False):
+        # A copy is made in this epoch already.
+        if not copy:
+            leaf = self._own(leaf)
+        return super(PersistentRedBlackTree, self)._add_leaf(
+            root, height, leaf, copy)
+
+    def _balance_path(self, path, node):
+        path = [(self._own(parent), go_right) for parent, go_right in path]
+        return super(PersistentRedBlackTree, self)._balance_path(path, node)
+
+    def _blacken(self, node):
+        if node is not None and node._color == RED:
+            node = self._own(node)
+        return super(PersistentRedBlackTree, self)._blacken(node)
+
+    def _flip_color(self, node):
+        node._left = self._own(node._left)
+        node._right = self._own(node._right)
+        super(PersistentRedBlackTree, self)._flip_color(node)
+
+    def _join(self, left, left_height, node, right, right_height):
+        if left is not None and left._color == RED:
+            left = self._own(left)
+        if right is not None and right._color == RED:
+            right = self._own(right)
+        return super(PersistentRedBlackTree, self)._join(
+            left, left_height, self._own(node), right, right_height)
+
+    def _make_left_red(self, node):
+        return super(PersistentRedBlackTree, self)._make_left_red(self._own(node))
+
+    def _make_right_red(self, node):
+        return super(PersistentRedBlackTree, self)._make_right_red(self._own(node))
+
+    def _rotate_left(self, node):
+        node._right = self._own(node._right)
+        return super(PersistentRedBlackTree, self)._rotate_left(node)
+
+    def _rotate_right(self, node):
+        node._left = self._own(node._left)
+        return super(PersistentRedBlackTree, self)._rotate_right(node)
+
+    def _swap_nodes(self, a, b):
+        # b lies below a, which is owned already: the path down to it is
+        # copied so the swap only writes to this version.
+        key = b._key
+        node = a
+        while node._key != key:
+            if node._key < key:
+                node._right = self._own(node._right)
+                node = node._right
+            else:
+                node._left = self._own(node._left)
+                node = node._left
+        super(PersistentRedBlackTree, self)._swap_nodes(a, node)
@@ -0,0 +1,114 @@
+from operator import itemgetter
+
+from rbtree import RedBlackTree
+
+
+class RedBlackTreeMap(RedBlackTree):
+
+    class Node(RedBlackTree.Node):
+        __slots__ = ('_value',)
+
+        def __init__(self, key):
+            super(RedBlackTreeMap.Node, self).__init__(key)
+            self._value = None
+
+        def get_value(self):
+            return self._value
+
+    class KeyedNode(Node):
+        __slots__ = ('_item',)
+
+        def get_item(self):
+            return self._item
+
+    ############################################################################
+
+    def __contains__(self, key):
+        return self.search(key)
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    def __getitem__(self, key):
+        probe = key
+        if self._key_func is not None:
+            probe = self._key_func(key)
+        node = self._search(self._root, probe)
+        if not node:
+            raise KeyError(key)
+        return node._value
+
+    def __setitem__(self, key, value):
+        self._insert_item(key)._value = value
+
+    def bulk_load(self, items):
+        # Takes (key, value) pairs. Keys that sort equal keep the first key
+        # and the last value, as they would with a dict or __setitem__.
+        sort_key = self._key_func
+        pairs = sorted(((sort_key(key) if sort_key is not None else key, key, value)
+                        for key, value in items), key=itemgetter(0))
+        unique = []
+        for pair in pairs:
+            if unique and not unique[-1][0] < pair[0]:
+                unique[-1] = unique[-1][:2] + pair[2:]
+            else:
+                unique.append(pair)
+        super(RedBlackTreeMap, self).bulk_load([key for _, key, _ in unique])
+        for node, pair in zip(self._scan(None, None, False), unique):
+            node._value = pair[2]
+
+    def get(self, key, default=None):
+        if self._key_func is not None:
+            key = self._key_func(key)
+        node = self._search(self._root, key)
+        return node._value if node else default
+
+    def items(self):
+        return ((self._get_item(node), node._value)
+                for node in self._scan(None, None, False))
+
+    def items_from(self, key):
+        if self._key_func is not None:
+            key = self._key_func(key)
+        return ((self._get_item(node), node._value)
+                for node in self._scan(key, None, False))
+
+    def keys(self):
+        return iter(self)
+
+    def pop(self, key, *default):
+        probe = key
+        if self._key_func is not None:
+            probe = self._key_func(key)
+        node = self._delete_key(probe)
+        if node is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        return node._value
+
+    def setdefault(self, key, default=None):
+        count = self._count
+        node = self._insert_item(key)
+        if self._count != count:
+            node._value = default
+        return node._value
+
+    def values(self):
+        return (node._value for node in self._scan(None, None, False))
+
+    ############################################################################
+
+    def _copy(self, other):
+        tree = self._new_tree()
+        tree.bulk_load(other.items())
+        return tree
+
+    def _copy_node(self, node):
+        copy = super(RedBlackTreeMap, self)._copy_node(node)
+        copy._value = node._value
+        return copy
+
+    def _swap_nodes(self, a, b):
+        super(RedBlackTreeMap, self)._swap_nodes(a, b)
+        a._value, b._value = b._value, a._value
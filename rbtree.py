@@ -1,20 +1,38 @@
+from operator import attrgetter, itemgetter
+from random import getrandbits
+
+from stats import TreeStats
+
+try:
+    from itertools import imap
+except ImportError:
+    imap = map
+
 RED = True
 BLACK = False
 
+# A union with a tree this many times smaller inserts its nodes one by one:
+# below that, splitting costs more than it saves.
+_SPLIT_RATIO = 8
+
 
 class RedBlackTree(object):
 
     _root = None
+    _count = 0
+    _version = 0
+    _key_func = None
+    _get_item = attrgetter('_key')
+    _stats = None
 
     class Node(object):
-        _color = None
-        _key = None
-        _left = None
-        _right = None
+        __slots__ = ('_color', '_key', '_left', '_right')
 
         def __init__(self, key):
             self._key = key
             self._color = RED
+            self._left = None
+            self._right = None
 
         def __eq__(self, other):
             if isinstance(other, self.__class__):
@@ -35,83 +53,841 @@ class RedBlackTree(object):
         def get_key(self):
             return self._key
 
+    class KeyedNode(Node):
+        __slots__ = ('_item',)
+
+        def get_item(self):
+            return self._item
+
     ############################################################################
 
+    def __init__(self, key=None):
+        # Without a key function nodes hold the keys themselves and the engine
+        # compares them with plain == and <, which for ints, floats and
+        # strings never leaves C. With one, every node caches its sort key in
+        # _key once and keeps the original in _item, so comparisons stay the
+        # same; the tree works on items from then on, two items with equal
+        # sort keys counting as duplicates.
+        if key is not None:
+            self._key_func = key
+            self._get_item = attrgetter('_item')
+            self.Node = self.KeyedNode
+
+    def __iter__(self):
+        return imap(self._get_item, self._scan(None, None, False))
+
+    def __len__(self):
+        return self._count
+
+    def __reversed__(self):
+        return imap(self._get_item, self._scan(None, None, True))
+
+    @classmethod
+    def from_sorted(cls, keys, key=None):
+        tree = cls(key=key) if key is not None else cls()
+        tree.bulk_load(keys)
+        return tree
+
+    def bulk_load(self, keys):
+        # Replaces the tree contents. Sorted input is used as is, anything
+        # else is sorted first; duplicate keys are dropped like insert does.
+        items = None
+        if self._key_func is not None:
+            items = sorted(((self._key_func(item), item) for item in keys),
+                           key=itemgetter(0))
+            items = [pair for index, pair in enumerate(items)
+                     if index == 0 or items[index - 1][0] < pair[0]]
+            keys = map(itemgetter(0), items)
+        keys = list(keys)
+        if not all(a < b for a, b in zip(keys, keys[1:])):
+            keys.sort()
+            keys = [key for index, key in enumerate(keys)
+                    if index == 0 or keys[index - 1] < key]
+        self._root, height = self._build_all([self.Node(key) for key in keys])
+        self._count = len(keys)
+        self._version += 1
+        if items is not None:
+            for node, (key, item) in zip(self._scan(None, None, False), items):
+                node._item = item
+
+    def ceiling(self, key):
+        if self._key_func is not None:
+            key = self._key_func(key)
+        node, found = self._root, None
+        while node is not None:
+            node_key = node._key
+            if node_key == key:
+                return self._get_item(node)
+            elif node_key < key:
+                node = node._right
+            else:
+                found, node = node, node._left
+        return self._get_item(found) if found is not None else None
+
+    def check(self, sample=None):
+        # Raises ValueError naming the first broken invariant -- key order,
+        # a red right link, two reds in a row, subtrees of unequal black
+        # heights, a red root -- and the keys on the path from the root to
+        # the node breaking it. Checks every node in one pass of O(n); given
+        # a sample, only that many random root-to-leaf paths in
+        # O(sample log n), cheap enough to run every so many operations on a
+        # live tree.
+        root = self._root
+        if root is None:
+            if self._count:
+                raise ValueError('empty tree counts %d keys' % self._count)
+            return
+        if root._color == RED:
+            self._fail('red root', [root])
+        if sample is not None:
+            height = self._black_height(root)
+            for _ in range(sample):
+                self._check_path(root, height)
+            return
+        # Nodes are visited on the way down and once more after their
+        # subtrees, which have left their black heights on heights by then.
+        path, heights, visited = [], [], 0
+        stack = [(root, 0, None, None, False)]
+        while stack:
+            node, depth, lo, hi, done = stack.pop()
+            if done:
+                del path[depth + 1:]
+                right = heights.pop() if node._right is not None else 0
+                left = heights.pop() if node._left is not None else 0
+                if left != right:
+                    self._fail('black heights %d and %d below' % (left, right), path)
+                heights.append(left + (node._color == BLACK))
+                continue
+            del path[depth:]
+            path.append(node)
+            visited += 1
+            if visited > self._count:
+                self._fail('more nodes than the %d keys counted' % self._count, path)
+            self._check_node(node, lo, hi, path)
+            stack.append((node, depth, lo, hi, True))
+            for child, lo, hi in ((node._right, node._key, hi), (node._left, lo, node._key)):
+                if child is not None:
+                    stack.append((child, depth + 1, lo, hi, False))
+        if visited != self._count:
+            raise ValueError('%d nodes but %d keys counted' % (visited, self._count))
+
     def delete(self, key):
-        if self.search(key):
-            if not(self._red(self._root._left) or self._red(self._root._right)):
-                self._root._color = RED
-            self._root = self._delete(self._root, key)
-            if self._root:
-                self._root._color = BLACK
+        if self._key_func is not None:
+            key = self._key_func(key)
+        node = self._delete_key(key)
+        return self._get_item(node) if node is not None else None
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.delete(key)
+
+    def difference(self, other):
+        # Removes every key of other from self. Like union, it takes the trees
+        # apart and joins the pieces; other is left as it is. Against a larger
+        # other, each key of self is looked up in it instead.
+        if other._count > self._count:
+            self._count -= self._combine(self._difference_lookup, other, copy=False)
+        else:
+            self._count -= self._combine(self._difference, other)
+
+    def floor(self, key):
+        if self._key_func is not None:
+            key = self._key_func(key)
+        node, found = self._root, None
+        while node is not None:
+            node_key = node._key
+            if node_key == key:
+                return self._get_item(node)
+            elif node_key < key:
+                found, node = node, node._right
+            else:
+                node = node._left
+        return self._get_item(found) if found is not None else None
 
     def insert(self, key):
-        self._root = self._insert(self._root, key)
-        self._root._color = BLACK
+        self._insert_item(key)
+
+    def insert_many(self, keys):
+        for key in keys:
+            self.insert(key)
+
+    def intersection(self, other):
+        # Keeps only the keys of self that other holds too; other is left as
+        # it is. Against a larger other, each key of self is looked up in it,
+        # as in difference.
+        if other._count > self._count:
+            self._count = self._combine(self._intersection_lookup, other, copy=False)
+        else:
+            self._count = self._combine(self._intersection, other)
+
+    def items_from(self, key):
+        if self._key_func is not None:
+            key = self._key_func(key)
+        return imap(self._get_item, self._scan(key, None, False))
+
+    def join(self, key, other):
+        # Appends key and then every key of other to self, in O(log n); the
+        # keys of self, key and the keys of other must come in that order.
+        # other is left empty.
+        self._join_trees(key, self._check_join(key, other), other)
+
+    def max(self):
+        return self._get_item(self._get_max(self._root)) if self._root is not None else None
+
+    def min(self):
+        return self._get_item(self._get_min(self._root)) if self._root is not None else None
+
+    def range(self, lo, hi):
+        # Both bounds are inclusive, as in OrderStatisticTree.count_range.
+        if self._key_func is not None:
+            lo, hi = self._key_func(lo), self._key_func(hi)
+        return imap(self._get_item, self._scan(lo, hi, False))
 
     def search(self, key):
+        if self._key_func is not None:
+            key = self._key_func(key)
         return bool(self._search(self._root, key))
 
+    def split(self, key):
+        # Moves every key greater than key into a new tree of the same kind
+        # and returns it; self keeps the rest. Relinking takes O(log n), but
+        # a plain tree then walks the smaller side to count both, so a split
+        # is O(min(k, n - k)) and O(n) near the middle. OrderStatisticTree
+        # reads the counts off its subtree sizes and splits in O(log n).
+        if self._key_func is not None:
+            key = self._key_func(key)
+        left, left_height, node, right, right_height = self._split(
+            self._root, self._black_height(self._root), key)
+        if node is not None:
+            left, left_height = self._join(left, left_height, node, None, 0)
+        tree = self._new_tree()
+        tree._root, self._root = self._blacken(right), self._blacken(left)
+        tree._count, self._count = self._count_apart(right, left, self._count)
+        tree._version += 1
+        self._version += 1
+        return tree
+
+    def start_stats(self):
+        # Counts the work of every operation from now on and times it; see
+        # TreeStats. Trees without stats run the engine untouched.
+        if self._stats is None:
+            self._stats = TreeStats()
+            self._stats.install(self)
+        return self._stats
+
+    def stop_stats(self):
+        stats, self._stats = self._stats, None
+        if stats is not None:
+            stats.uninstall(self)
+        return stats
+
+    def union(self, other):
+        # Adds every key of other to self in O(m log(n / m + 1)) for an other
+        # of m <= n keys, taking both apart and joining the pieces; other is
+        # left as it is. A key held by both keeps the node of self. The keys of
+        # a far smaller other are simply inserted, in new nodes, without
+        # copying other first, which is faster in practice. A larger other is
+        # copied whole, in O(m): self ends up holding that many keys anyway.
+        count = self._count + other._count
+        if other._count * _SPLIT_RATIO < self._count:
+            self._count = count - self._combine(self._add_all, other, copy=False)
+        else:
+            self._count = count - self._combine(self._union, other)
+
     ############################################################################
 
+    def _delete_key(self, key):
+        # One descent locates the key and records the path to it, so a miss
+        # costs no more than a search and leaves the tree untouched. When the
+        # key, its predecessor or its successor sits on a red leaf, the key is
+        # moved down there and the leaf is cut off directly: that keeps every
+        # invariant and needs no rebalancing. Only the remaining cases run the
+        # top-down _delete.
+        path = []
+        node = self._root
+        while node is not None:
+            node_key = node._key
+            if node_key == key:
+                break
+            path.append(node)
+            node = node._right if node_key < key else node._left
+        else:
+            return None
+        self._version += 1
+
+        left, right = node._left, node._right
+        if left is None:
+            if node._color == RED:
+                self._unlink(path, node)
+                return node
+        elif right is None:
+            # Only a 3-node's black key can lack a right child.
+            self._swap_nodes(node, left)
+            path.append(node)
+            self._unlink(path, left)
+            return left
+        else:
+            path.append(node)
+            depth = len(path)
+            leaf = left
+            while leaf._right is not None:
+                path.append(leaf)
+                leaf = leaf._right
+            if leaf._left is not None:
+                self._swap_nodes(node, leaf)
+                path.append(leaf)
+                leaf, node = leaf._left, leaf
+            elif leaf._color != RED:
+                del path[depth:]
+                leaf = self._get_min(right)
+                if leaf._color != RED:
+                    leaf = None
+                else:
+                    path.append(right)
+                    while path[-1]._left is not leaf:
+                        path.append(path[-1]._left)
+            if leaf is not None:
+                self._swap_nodes(node, leaf)
+                self._unlink(path, leaf)
+                return leaf
+
+        if not(self._red(self._root._left) or self._red(self._root._right)):
+            self._root._color = RED
+        self._root, removed = self._delete(self._root, key)
+        if self._root:
+            self._root._color = BLACK
+        return removed
+
     def _delete(self, node, key):
-        go_right = None
-        if node == key:
-            if node._left is not None:
-                go_right = False
-                node = self._make_left_red(node)
-            elif node._right is not None:
-                go_right = True
+        path = []
+        while True:
+            go_right = None
+            if node._key == key:
+                if node._left is not None:
+                    go_right = False
+                    node = self._make_left_red(node)
+                elif node._right is not None:
+                    go_right = True
+                    node = self._make_right_red(node)
+                else:
+                    self._remove_node(node)
+                    removed, node = node, None
+                    break
+
+                if node._key == key:
+                    if go_right:
+                        min_node = self._get_min(node._right)
+                        self._swap_nodes(node, min_node)
+                    else:
+                        max_node = self._get_max(node._left)
+                        self._swap_nodes(node, max_node)
+                else:
+                    go_right = None
+
+            if go_right or (go_right is None and node._key < key):
                 node = self._make_right_red(node)
+                path.append((node, True))
+                node = node._right
             else:
-                return None
+                node = self._make_left_red(node)
+                path.append((node, False))
+                node = node._left
+
+        return self._balance_path(path, node), removed
+
+    def _insert_item(self, item):
+        if self._key_func is None:
+            return self._insert_key(item)
+        count = self._count
+        node = self._insert_key(self._key_func(item))
+        if self._count != count:
+            node._item = item
+        return node
 
-            if node == key:
-                if go_right:
-                    min_node = self._get_min(node._right)
-                    self._swap_nodes(node, min_node)
-                else:
-                    max_node = self._get_max(node._left)
-                    self._swap_nodes(node, max_node)
+    def _insert_key(self, key):
+        self._root, node = self._insert(self._root, key)
+        self._root._color = BLACK
+        return node
+
+    def _insert(self, node, key):
+        path = []
+        while node is not None:
+            node_key = node._key
+            if node_key == key:
+                return (path[0][0] if path else node), node
+            go_right = node_key < key
+            path.append((node, go_right))
+            node = node._right if go_right else node._left
+
+        node = self._new_node(key, path)
+        return self._balance_path(path, node), node
+
+    def _search(self, node, key):
+        while node is not None:
+            node_key = node._key
+            if node_key == key:
+                return node
+            node = node._right if node_key < key else node._left
+        return False
+
+    ############################################################################
+
+    def _adopt(self, root, count):
+        # Makes a ready-built node structure the contents of the tree.
+        self._root = root
+        self._count = count
+        self._version += 1
+
+    def _balance_path(self, path, node):
+        while path:
+            parent, go_right = path.pop()
+            if go_right:
+                parent._right = node
             else:
-                go_right = None
+                parent._left = node
+            node = self._local_balance(parent)
+        return node
 
-        if (go_right is not None and go_right) or (go_right is None and (node < key)):
-            node = self._make_right_red(node)
-            node._right = self._delete(node._right, key)
+    def _build(self, nodes, lo, hi, height):
+        # Links new nodes[lo:hi], in key order, into a subtree with ``height``
+        # black levels, which fits between 2 ** height - 1 and 3 ** height - 1
+        # nodes. Every level is made of 2-nodes while they suffice, otherwise
+        # of 3-nodes (a black node with a red left child), so no red link
+        # leans right.
+        size = hi - lo
+        if not size:
+            return None
+        height -= 1
+        if size - 1 <= 2 * (3 ** height - 1):
+            mid = lo + (size - 1) // 2
+            node = nodes[mid]
+            node._left = self._build(nodes, lo, mid, height)
+            node._right = self._build(nodes, mid + 1, hi, height)
         else:
-            node = self._make_left_red(node)
-            node._left = self._delete(node._left, key)
-
-        node = self._local_balance(node)
+            third, rest = divmod(size - 2, 3)
+            first = lo + third + (rest > 0)
+            second = first + 1 + third + (rest > 1)
+            red = nodes[first]
+            red._left = self._build(nodes, lo, first, height)
+            red._right = self._build(nodes, first + 1, second, height)
+            node = nodes[second]
+            node._left = red
+            node._right = self._build(nodes, second + 1, hi, height)
+        node._color = BLACK
         return node
 
-    def _insert(self, node, key):
-        if node is None:
-            return self.Node(key)
+    def _build_all(self, nodes):
+        # _build for all of nodes; returns the root and its black height.
+        height = 0
+        while (2 << height) - 1 <= len(nodes):
+            height += 1
+        return self._build(nodes, 0, len(nodes), height), height
+
+    def _iter_in_order(self, node):
+        stack = []
+        while True:
+            while node is not None:
+                stack.append(node)
+                node = node._left
+            if not stack:
+                return
+            node = stack.pop()
+            yield node
+            node = node._right
 
-        if node == key:
-            return node
-        elif node < key:
-            node._right = self._insert(node._right, key)
-        else:
-            node._left = self._insert(node._left, key)
+    def _iter_nodes(self, node):
+        stack = [node] if node is not None else []
+        while stack:
+            node = stack.pop()
+            yield node
+            if node._right is not None:
+                stack.append(node._right)
+            if node._left is not None:
+                stack.append(node._left)
+
+    def _new_tree(self):
+        if self._key_func is not None:
+            return self.__class__(key=self._key_func)
+        return self.__class__()
+
+    def _new_node(self, key, path):
+        self._count += 1
+        self._version += 1
+        return self.Node(key)
+
+    def _remove_node(self, node):
+        self._count -= 1
+
+    def _unlink(self, path, leaf):
+        # Cuts off a red leaf; path holds its ancestors, parent last. A red
+        # node is always a left child.
+        path[-1]._left = None
+        self._remove_node(leaf)
+
+    def _scan(self, lo, hi, reverse):
+        # In-order walk over lo <= key <= hi (None leaves a side open). The
+        # stack holds at most one pending ancestor per level, and subtrees
+        # outside the bounds are never entered.
+        version = self._version
+        stack = []
+        node = self._root
+        while True:
+            while node is not None:
+                if reverse:
+                    if hi is not None and hi < node._key:
+                        node = node._left
+                    else:
+                        stack.append(node)
+                        node = node._right
+                else:
+                    if lo is not None and node._key < lo:
+                        node = node._right
+                    else:
+                        stack.append(node)
+                        node = node._left
+            if not stack:
+                return
+            node = stack.pop()
+            if reverse:
+                if lo is not None and node._key < lo:
+                    return
+            elif hi is not None and hi < node._key:
+                return
+            yield node
+            if self._version != version:
+                raise RuntimeError('tree changed during iteration')
+            node = node._left if reverse else node._right
 
-        node = self._local_balance(node)
+    ############################################################################
+    # Join-based set operations. Every subtree is passed along with its black
+    # height, which makes a join cost O(1 + the difference in heights); the
+    # recursion in union, intersection and difference goes no deeper than
+    # the first tree is high. Their second tree is a copy of other, which
+    # costs O(m) for an other of m keys, so intersection and difference only
+    # take this path when other is no larger than self; otherwise the
+    # _lookup operations search other for each key of self, in O(n log m).
+
+    def _add_all(self, a, a_height, b, b_height):
+        # _union for a b much smaller than a. b is left as it is; its keys go
+        # into new nodes, in key order, so that one search runs mostly down
+        # the path the last one left warm, as insert_many with sorted keys.
+        common = 0
+        for node in self._iter_in_order(b):
+            a, a_height, found = self._add_leaf(a, a_height, node, copy=True)
+            common += found is not None
+        return a, a_height, common
+
+    def _add_leaf(self, root, height, leaf, copy=False):
+        # Hangs a node, without its children, into the tree at root as insert
+        # would, unless its key is there already; with copy, a new node takes
+        # its place and leaf is left as it is. Returns the root and black
+        # height of the result and the node found holding the key, if any.
+        key = leaf._key
+        path, node = [], root
+        while node is not None:
+            node_key = node._key
+            if node_key == key:
+                return root, height, node
+            go_right = node_key < key
+            path.append((node, go_right))
+            node = node._right if go_right else node._left
+        if copy:
+            # A new node is a red leaf already, with nothing to rebalance.
+            leaf = self._copy_node(leaf)
+        else:
+            leaf._left = leaf._right = None
+            leaf._color = RED
+            leaf = self._local_balance(leaf)
+        root = self._balance_path(path, leaf)
+        if root._color == RED:
+            root._color = BLACK
+            height += 1
+        return root, height, None
+
+    def _black_height(self, node):
+        height = 0
+        while node is not None:
+            height += node._color == BLACK
+            node = node._left
+        return height
 
+    def _blacken(self, node):
+        # Colors the root of a tree black; returns the root.
+        if node is not None:
+            node._color = BLACK
         return node
 
-    def _search(self, node, key):
+    def _check_join(self, key, other):
+        # Raises unless self, key and other can be joined in that order;
+        # returns the sort key of key.
+        self._check_kind(other)
+        if self._key_func is not None:
+            key = self._key_func(key)
+        if ((self._root is not None and not self._get_max(self._root)._key < key) or
+                (other._root is not None and not key < other._get_min(other._root)._key)):
+            raise ValueError('keys out of order')
+        return key
+
+    def _check_kind(self, other):
+        if (type(other) is not type(self) or other is self or
+                (other._key_func is None) != (self._key_func is None)):
+            raise TypeError('can only combine with another tree of the same kind')
+
+    def _clear(self):
+        self._root = None
+        self._count = 0
+        self._version += 1
+
+    def _combine(self, operation, other, copy=True):
+        # Runs a set operation on the roots of self and of a copy of other,
+        # which the operation takes apart instead of other itself; an
+        # operation that leaves other as it is may skip the copy. The copy
+        # takes O(m) for an other of m keys. Returns the number of keys found
+        # in both.
+        self._check_kind(other)
+        if copy:
+            other = self._copy(other)
+        root, height, common = operation(
+            self._root, self._black_height(self._root),
+            other._root, self._black_height(other._root))
+        self._root = self._blacken(root)
+        self._version += 1
+        return common
+
+    def _copy(self, other):
+        # A tree of the same kind holding what other holds, in nodes of its
+        # own; O(m), as bulk_load takes sorted input as is. Callers only copy
+        # an other no larger than self, or one that self will hold all of.
+        tree = self._new_tree()
+        tree.bulk_load(other)
+        return tree
+
+    def _copy_node(self, node):
+        # A new node of this tree holding what node, of a tree of the same
+        # kind, holds.
+        copy = self.Node(node._key)
+        if self._key_func is not None:
+            copy._item = node._item
+        return copy
+
+    def _count_apart(self, a, b, total):
+        # Node counts of two subtrees with ``total`` nodes between them. They
+        # are walked side by side, so only the smaller one is walked to its end.
+        nodes_a, nodes_b = self._iter_nodes(a), self._iter_nodes(b)
+        count = 0
+        while True:
+            if next(nodes_a, None) is None:
+                return count, total - count
+            if next(nodes_b, None) is None:
+                return total - count, count
+            count += 1
+
+    def _difference(self, a, a_height, b, b_height):
+        if a is None or b is None:
+            return a, a_height, 0
+        a, left, right, common = self._take_apart(a, a_height, b, b_height)
+        left, left_height, left_common = self._difference(*left)
+        right, right_height, right_common = self._difference(*right)
+        if common or a is None:
+            root, height = self._join_pair(left, left_height, right, right_height)
+        else:
+            root, height = self._join(left, left_height, a, right, right_height)
+        return root, height, left_common + right_common + common
+
+    def _difference_lookup(self, a, a_height, b, b_height):
+        # _difference for a b larger than a, which is only searched.
+        return self._filter(a, b, False)
+
+    def _filter(self, a, b, found):
+        # Rebuilds, in new nodes, the keys of a that b holds (found) or lacks
+        # (not found). b is only searched, so this takes O(n log m) for n keys
+        # in a and m in b, whatever the size of b. Returns the root and black
+        # height of the result and the number of keys found in both.
+        nodes, count = [], 0
+        for node in self._iter_in_order(a):
+            count += 1
+            if bool(self._search(b, node._key)) == found:
+                nodes.append(self._copy_node(node))
+        root, height = self._build_all(nodes)
+        return root, height, len(nodes) if found else count - len(nodes)
+
+    def _intersection(self, a, a_height, b, b_height):
+        if a is None or b is None:
+            return None, 0, 0
+        a, left, right, common = self._take_apart(a, a_height, b, b_height)
+        left, left_height, left_common = self._intersection(*left)
+        right, right_height, right_common = self._intersection(*right)
+        if common:
+            root, height = self._join(left, left_height, a, right, right_height)
+        else:
+            root, height = self._join_pair(left, left_height, right, right_height)
+        return root, height, left_common + right_common + common
+
+    def _intersection_lookup(self, a, a_height, b, b_height):
+        # _intersection for a b larger than a, which is only searched.
+        return self._filter(a, b, True)
+
+    def _join(self, left, left_height, node, right, right_height):
+        # Links left, node and right, in key order, into one tree and returns
+        # its root, which is black, and its black height. node is hung as a
+        # red node from the spine of the higher tree where the black heights
+        # match, and the path above it is balanced as after an insert.
+        if left is not None and left._color == RED:
+            left._color = BLACK
+            left_height += 1
+        if right is not None and right._color == RED:
+            right._color = BLACK
+            right_height += 1
+        node._color = RED
+        path = []
+        if left_height > right_height:
+            child, height = left, left_height
+            while child is not None and (child._color == RED or height > right_height):
+                path.append((child, True))
+                height -= child._color == BLACK
+                child = child._right
+            node._left, node._right = child, right
+            height = left_height
+        else:
+            child, height = right, right_height
+            while child is not None and (child._color == RED or height > left_height):
+                path.append((child, False))
+                height -= child._color == BLACK
+                child = child._left
+            node._left, node._right = left, child
+            height = right_height
+        root = self._balance_path(path, self._local_balance(node))
+        if root._color == RED:
+            root._color = BLACK
+            height += 1
+        return root, height
+
+    def _join_pair(self, left, left_height, right, right_height):
+        # _join without a node in between: the largest key of left takes its
+        # place.
+        if left is None:
+            return right, right_height
+        if right is None:
+            return left, left_height
+        left, left_height, node, rest, rest_height = self._split(
+            left, left_height, self._get_max(left)._key)
+        return self._join(left, left_height, node, right, right_height)
+
+    def _join_trees(self, item, key, other):
+        # join, once _check_join has passed; key is the sort key of item.
+        node = self._new_node(key, [])
+        if self._key_func is not None:
+            node._item = item
+        self._root, height = self._join(
+            self._root, self._black_height(self._root), node,
+            other._root, self._black_height(other._root))
+        self._count += other._count
+        other._clear()
+
+    def _split(self, node, height, key):
+        # Takes the subtree at node, of black height ``height``, apart around
+        # key: returns the tree of the smaller keys and its black height, the
+        # node holding key or None, and the tree of the greater keys and its
+        # black height. The subtrees hanging off the search path are joined
+        # back together from the bottom up.
+        path = []
+        while node is not None and node._key != key:
+            go_right = node._key < key
+            path.append((node, height, go_right))
+            height -= node._color == BLACK
+            node = node._right if go_right else node._left
         if node is None:
-            return False
-        elif node == key:
-            return node
-        elif node < key:
-            return self._search(node._right, key)
+            left = right = None
+            left_height = right_height = 0
         else:
-            return self._search(node._left, key)
+            left, right = node._left, node._right
+            left_height = right_height = height - (node._color == BLACK)
+        while path:
+            parent, height, go_right = path.pop()
+            child_height = height - (parent._color == BLACK)
+            if go_right:
+                left, left_height = self._join(
+                    parent._left, child_height, parent, left, left_height)
+            else:
+                right, right_height = self._join(
+                    right, right_height, parent, parent._right, child_height)
+        return left, left_height, node, right, right_height
+
+    def _take_apart(self, a, a_height, b, b_height):
+        # One step of a set operation: splits the higher of two trees by the
+        # root key of the lower one, so the recursion follows the smaller
+        # tree. Returns the node of a with that key or None, the arguments of
+        # the recursion on either side of it, and whether b holds the key too.
+        if a_height < b_height:
+            child_height = a_height - (a._color == BLACK)
+            a_left, a_right = a._left, a._right
+            b_left, b_left_height, node, b_right, b_right_height = self._split(
+                b, b_height, a._key)
+            return (a,
+                    (a_left, child_height, b_left, b_left_height),
+                    (a_right, child_height, b_right, b_right_height),
+                    node is not None)
+        child_height = b_height - (b._color == BLACK)
+        b_left, b_right = b._left, b._right
+        a_left, a_left_height, node, a_right, a_right_height = self._split(
+            a, a_height, b._key)
+        return (node,
+                (a_left, a_left_height, b_left, child_height),
+                (a_right, a_right_height, b_right, child_height),
+                node is not None)
+
+    def _union(self, a, a_height, b, b_height):
+        # Returns the root and black height of the union and the number of
+        # keys found in both; a key found in both keeps the node of a.
+        if a is None:
+            return b, b_height, 0
+        if b is None:
+            return a, a_height, 0
+        # Single nodes are cheaper to insert than to split by.
+        if b._left is None and b._right is None:
+            root, height, node = self._add_leaf(a, a_height, b)
+            return root, height, node is not None
+        if a._left is None and a._right is None:
+            root, height, node = self._add_leaf(b, b_height, a)
+            if node is None:
+                return root, height, 0
+        pivot = b
+        a, left, right, common = self._take_apart(a, a_height, b, b_height)
+        left, left_height, left_common = self._union(*left)
+        right, right_height, right_common = self._union(*right)
+        root, height = self._join(left, left_height, a if a is not None else pivot,
+                                  right, right_height)
+        return root, height, left_common + right_common + common
+
+    def _check_node(self, node, lo, hi, path):
+        # The invariants of node alone, lo and hi being the keys it must lie
+        # between.
+        key = node._key
+        if (lo is not None and not lo < key) or (hi is not None and not key < hi):
+            self._fail('key out of order', path)
+        if self._red(node._right):
+            self._fail('red right link', path)
+        if node._color == RED and self._red(node._left):
+            self._fail('two reds in a row', path)
+
+    def _check_path(self, node, height):
+        # check() along one random root-to-leaf path.
+        path, lo, hi, blacks = [], None, None, 0
+        while node is not None:
+            path.append(node)
+            blacks += node._color == BLACK
+            self._check_node(node, lo, hi, path)
+            if getrandbits(1):
+                lo, node = node._key, node._right
+            else:
+                hi, node = node._key, node._left
+        if blacks != height:
+            # The path only shows that some node has subtrees of unequal
+            # black heights; the full check finds which.
+            self.check()
 
-    ############################################################################
+    def _fail(self, problem, path):
+        raise ValueError('%s at %s' % (problem, ' > '.join(repr(node._key) for node in path)))
 
     def _get_min(self, node):
         while node._left:
@@ -124,14 +900,14 @@ class RedBlackTree(object):
         return node
 
     def _red(self, node):
-        return node and node._color == RED
+        return node is not None and node._color == RED
 
     ############################################################################
 
     def _flip_color(self, node):
-        ~node
-        ~node._left
-        ~node._right
+        node._color = not node._color
+        node._left._color = not node._left._color
+        node._right._color = not node._right._color
 
     def _local_balance(self, node):
         if self._red(node._right) and not self._red(node._left):
@@ -181,4 +957,6 @@ class RedBlackTree(object):
 
     def _swap_nodes(self, a, b):
         a._key, b._key = b._key, a._key
+        if self._key_func is not None:
+            a._item, b._item = b._item, a._item
 
@@ -0,0 +1,232 @@
+import os
+import sys
+from argparse import ArgumentParser
+from xml.sax.saxutils import escape
+
+from layout import (CIRCLE_RADIUS, GLYPH_LABEL_HEIGHT, MIN_SPACING, PEN_WEIGHT,
+                    ROW_DISTANCE, get_detail_row, get_glyph_label, get_glyph_shape,
+                    get_parent_slot, get_slot_coord, summarize)
+from model import RBTreeTrace
+from replay import RBTreePlayer
+from rbtree import RED, BLACK
+
+try:
+    from PySide import QtCore, QtGui
+except ImportError:
+    QtGui = None
+
+
+_FONT_SIZE = 12
+_MIN_FONT_SIZE = 4
+# Rough advance of a digit in a sans-serif font, in font sizes.
+_CHAR_WIDTH = 0.6
+
+_COLORS = {RED: '#ff0000', BLACK: '#000000'}
+_GLYPH_FILL = '#c0c0c0'
+_BACKGROUND = '#ffffff'
+
+_app = None
+
+
+class RBTreeRenderer(object):
+    # Draws still images of a tree without a window: SVG with nothing but the
+    # standard library, PNG through Qt's raster engine (any platform plugin,
+    # offscreen included). The picture is the one RBTreeView shows at zoom 1
+    # on a canvas ``width`` wide -- rows too dense to tell apart are drawn as
+    # one glyph per subtree -- so its size stays bounded however big the tree.
+
+    _width = None
+    _detail_row = None
+
+    def __init__(self, width=1920.0):
+        self._width = float(width)
+        self._detail_row = get_detail_row(self._width, 1.0, MIN_SPACING)
+
+    def get_shapes(self, tree):
+        # Returns (lines, circles, glyphs, height) for tree, which may be any
+        # RedBlackTree: lines are (x1, y1, x2, y2, color), circles (x, y, key)
+        # and glyphs (slot, color, node count, black height).
+        lines, circles, glyphs = [], [], []
+        depth = 0
+        stack = [(tree._root, (0, 0))] if tree._root is not None else []
+        while stack:
+            node, slot = stack.pop()
+            depth = max(depth, slot[0] + 1)
+            lines.append(get_slot_coord(slot, self._width) +
+                         get_slot_coord(get_parent_slot(slot), self._width) +
+                         (node.get_color(),))
+            if slot[0] == self._detail_row:
+                glyphs.append((slot, node.get_color()) +
+                              summarize(node, _get_children))
+                continue
+            circles.append(get_slot_coord(slot, self._width) + (node.get_key(),))
+            row, col = slot
+            if node._left is not None:
+                stack.append((node._left, (row + 1, col * 2)))
+            if node._right is not None:
+                stack.append((node._right, (row + 1, col * 2 + 1)))
+        height = (depth + 1) * ROW_DISTANCE
+        for glyph in glyphs:
+            label_pos = get_glyph_shape(glyph[0], self._width)[1]
+            if label_pos is not None:
+                height = max(height, label_pos[1] + GLYPH_LABEL_HEIGHT)
+        return lines, circles, glyphs, height
+
+    def save(self, tree, path):
+        # Writes tree to path, as PNG if its extension says so, else as SVG.
+        if os.path.splitext(path)[1].lower() == '.png':
+            self.save_png(tree, path)
+        else:
+            with open(path, 'w') as stream:
+                self.write_svg(tree, stream)
+
+    def save_frames(self, trace, pattern, events_per_frame=1):
+        # Replays trace and saves the tree every ``events_per_frame`` events,
+        # to pattern % frame number (e.g. 'frames/%05d.svg'), starting with
+        # the tree the trace starts from. Returns the number of frames.
+        player = RBTreePlayer(trace)
+        if next(iter(trace), ('',))[0] == 'reset':
+            # A player starts out empty; the trace opens by loading the tree
+            # it was recorded from, which frame 0 shows instead.
+            player.step()
+        frame = 0
+        while True:
+            self.save(player, pattern % frame)
+            frame += 1
+            if player.get_position() >= player.get_length():
+                return frame
+            player.step(events_per_frame)
+
+    def save_png(self, tree, path):
+        if QtGui is None:
+            raise RuntimeError('PNG output needs PySide; use SVG instead')
+        _ensure_app()
+        lines, circles, glyphs, height = self.get_shapes(tree)
+        image = QtGui.QImage(int(self._width), int(height),
+                             QtGui.QImage.Format_RGB32)
+        image.fill(QtGui.QColor(_BACKGROUND).rgb())
+        painter = QtGui.QPainter(image)
+        try:
+            painter.setRenderHint(QtGui.QPainter.Antialiasing)
+            pens = dict((color, QtGui.QPen(QtGui.QColor(value), PEN_WEIGHT))
+                        for color, value in _COLORS.items())
+            for x1, y1, x2, y2, color in lines:
+                painter.setPen(pens[color])
+                painter.drawLine(QtCore.QPointF(x1, y1), QtCore.QPointF(x2, y2))
+            painter.setPen(pens[BLACK])
+            painter.setBrush(QtGui.QColor(_GLYPH_FILL))
+            font = QtGui.QFont()
+            font.setPixelSize(_FONT_SIZE)
+            painter.setFont(font)
+            for points, label, label_pos in self._get_glyph_shapes(glyphs):
+                painter.drawPolygon(QtGui.QPolygonF(
+                    [QtCore.QPointF(*point) for point in points]))
+                if label is not None:
+                    x, y = label_pos
+                    for line in label:
+                        y += _FONT_SIZE
+                        painter.drawText(QtCore.QPointF(x, y), line)
+            painter.setBrush(QtGui.QColor(_BACKGROUND))
+            for x, y, key in circles:
+                painter.drawEllipse(QtCore.QPointF(x, y), CIRCLE_RADIUS,
+                                    CIRCLE_RADIUS)
+                text = str(key)
+                font.setPixelSize(_get_font_size(text))
+                painter.setFont(font)
+                painter.drawText(QtCore.QRectF(x - CIRCLE_RADIUS, y - CIRCLE_RADIUS,
+                                               2 * CIRCLE_RADIUS, 2 * CIRCLE_RADIUS),
+                                 QtCore.Qt.AlignCenter, text)
+        finally:
+            painter.end()
+        if not image.save(path, 'PNG'):
+            raise IOError('cannot write %s' % path)
+
+    def write_svg(self, tree, stream):
+        lines, circles, glyphs, height = self.get_shapes(tree)
+        write = stream.write
+        write('<svg xmlns="http://www.w3.org/2000/svg" width="%g" height="%g" '
+              'font-family="sans-serif" text-anchor="middle">\n'
+              % (self._width, height))
+        write('<rect width="100%%" height="100%%" fill="%s"/>\n' % _BACKGROUND)
+        write('<g stroke-width="%g">\n' % PEN_WEIGHT)
+        for x1, y1, x2, y2, color in lines:
+            write('<line x1="%g" y1="%g" x2="%g" y2="%g" stroke="%s"/>\n'
+                  % (x1, y1, x2, y2, _COLORS[color]))
+        write('</g>\n<g stroke="%s" fill="%s">\n' % (_COLORS[BLACK], _GLYPH_FILL))
+        for points, label, label_pos in self._get_glyph_shapes(glyphs):
+            write('<polygon points="%s"/>\n'
+                  % ' '.join('%g,%g' % point for point in points))
+            if label is not None:
+                x, y = label_pos
+                for line in label:
+                    y += _FONT_SIZE
+                    write('<text x="%g" y="%g" font-size="%d" text-anchor="start" '
+                          'stroke="none" fill="%s">%s</text>\n'
+                          % (x, y, _FONT_SIZE, _COLORS[BLACK], escape(line)))
+        write('</g>\n<g stroke="%s" stroke-width="%g" fill="%s">\n'
+              % (_COLORS[BLACK], PEN_WEIGHT, _BACKGROUND))
+        for x, y, key in circles:
+            text = str(key)
+            write('<circle cx="%g" cy="%g" r="%d"/>'
+                  '<text x="%g" y="%g" font-size="%d" stroke="none" fill="%s">'
+                  '%s</text>\n'
+                  % (x, y, CIRCLE_RADIUS, x, y + _get_font_size(text) * 0.35,
+                     _get_font_size(text), _COLORS[BLACK], escape(text)))
+        write('</g>\n</svg>\n')
+
+    ############################################################################
+
+    def _get_glyph_shapes(self, glyphs):
+        # The triangle of every glyph, like RBTreeView draws them, with the
+        # lines of its label and their top left corner, if it has one.
+        for slot, color, count, black_height in glyphs:
+            points, label_pos = get_glyph_shape(slot, self._width)
+            label = None
+            if label_pos is not None:
+                label = get_glyph_label(count, black_height).split('\n')
+            yield points, label, label_pos
+
+
+def _ensure_app():
+    # Fonts need an application object; a headless one if there is none yet.
+    global _app
+    if QtGui.QApplication.instance() is None:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        _app = QtGui.QApplication(sys.argv[:1], False)
+
+
+def _get_children(node):
+    return node._left, node._right
+
+
+def _get_font_size(text):
+    # The largest size up to _FONT_SIZE that fits text into a circle.
+    size = int(2 * CIRCLE_RADIUS * 0.85 / (_CHAR_WIDTH * max(len(text), 1)))
+    return max(_MIN_FONT_SIZE, min(_FONT_SIZE, size))
+
+
+def main(argv=None):
+    parser = ArgumentParser(description='Renders a recorded trace to a '
+                                        'numbered sequence of SVG or PNG frames.')
+    parser.add_argument('trace', help='trace file written by RBTreeTrace.dump')
+    parser.add_argument('pattern', help="output file pattern, e.g. 'out/%%05d.svg'")
+    parser.add_argument('--width', type=float, default=1920.0)
+    parser.add_argument('--events-per-frame', type=int, default=1)
+    parser.add_argument('--last', action='store_true',
+                        help='only save the tree at the end of the trace, '
+                             'to the pattern for frame 0')
+    args = parser.parse_args(argv)
+    with open(args.trace) as stream:
+        trace = RBTreeTrace.load(stream)
+    renderer = RBTreeRenderer(args.width)
+    if args.last:
+        player = RBTreePlayer(trace)
+        player.seek(player.get_length())
+        renderer.save(player, args.pattern % 0)
+    else:
+        count = renderer.save_frames(trace, args.pattern, args.events_per_frame)
+        sys.stdout.write('%d frames\n' % count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+from model import RBTreeModel
+
+
+class RBTreePlayer(RBTreeModel):
+    # Plays an RBTreeTrace back onto a tree of its own. It is a model like any
+    # other to its observers -- every replayed event fires the same hooks the
+    # recorded operation did -- so RBTreeView and RBTreeController work with
+    # it unchanged, at whatever pace step() is called.
+
+    _events = None
+    _position = 0
+    _nodes = None
+    _parents = None
+
+    def __init__(self, trace):
+        super(RBTreePlayer, self).__init__()
+        self._events = list(trace)
+        self._nodes = {}
+        self._parents = {}
+
+    def get_length(self):
+        return len(self._events)
+
+    def get_position(self):
+        return self._position
+
+    def seek(self, position):
+        # Jumps to the tree as it was after ``position`` events: the events up
+        # to there are replayed silently and observers see one reload.
+        position = max(0, min(position, len(self._events)))
+        old_nodes = list(self._iter_nodes(self._root))
+        hooks, self._hooks = self._hooks, {}
+        self._update_observers()
+        try:
+            self._root = None
+            self._count = 0
+            self._nodes.clear()
+            self._parents.clear()
+            for event in self._events[:position]:
+                self._replay(event)
+            self._position = position
+        finally:
+            self._hooks = hooks
+            self._update_observers()
+        self._after_load(old_nodes)
+
+    def step(self, count=1):
+        # Replays up to ``count`` events; returns False at the end of the trace.
+        for index in range(count):
+            if self._position >= len(self._events):
+                break
+            self._replay(self._events[self._position])
+            self._position += 1
+        return self._position < len(self._events)
+
+    ############################################################################
+
+    def _link(self, parent, go_right, node):
+        if parent is None:
+            self._root = node
+        elif go_right:
+            parent._right = node
+        else:
+            parent._left = node
+        if node is not None:
+            self._parents[id(node)] = parent
+
+    def _replace(self, node, child):
+        # Puts child where node hangs from its parent.
+        parent = self._parents[id(node)]
+        self._link(parent, parent is not None and parent._right is node, child)
+
+    def _replay(self, event):
+        getattr(self, '_replay_' + event[0])(*event[1:])
+
+    ############################################################################
+
+    def _replay_color(self, node_id, color):
+        self._nodes[node_id]._color = color
+        self._after_tree_update()
+
+    def _replay_create(self, node_id, key, parent_id, go_right):
+        parent = self._nodes[parent_id] if parent_id is not None else None
+        path = [(parent, go_right)] if parent is not None else []
+        node = self._new_node(key, path)
+        self._nodes[node_id] = node
+        self._link(parent, go_right, node)
+
+    def _replay_delete(self, node_id):
+        node = self._nodes.pop(node_id)
+        self._replace(node, None)
+        del self._parents[id(node)]
+        self._remove_node(node)
+        self._after_tree_update()
+
+    def _replay_flip(self, node_id):
+        self._flip_color(self._nodes[node_id])
+
+    def _replay_reset(self, nodes):
+        old_nodes = list(self._iter_nodes(self._root))
+        self._root = None
+        self._nodes.clear()
+        self._parents.clear()
+        for node_id, key, color, parent_id, go_right in nodes:
+            node = self.Node(key)
+            node._color = color
+            self._nodes[node_id] = node
+            parent = self._nodes[parent_id] if parent_id is not None else None
+            self._link(parent, go_right, node)
+        self._count = len(nodes)
+        self._version += 1
+        self._after_load(old_nodes)
+
+    def _replay_rotate_left(self, node_id):
+        node = self._nodes[node_id]
+        moved = node._right._left
+        top = self._rotate_left(node)
+        self._replace(node, top)
+        self._parents[id(node)] = top
+        if moved is not None:
+            self._parents[id(moved)] = node
+
+    def _replay_rotate_right(self, node_id):
+        node = self._nodes[node_id]
+        moved = node._left._right
+        top = self._rotate_right(node)
+        self._replace(node, top)
+        self._parents[id(node)] = top
+        if moved is not None:
+            self._parents[id(moved)] = node
+
+    def _replay_swap(self, a, b):
+        self._swap_nodes(self._nodes[a], self._nodes[b])
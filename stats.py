@@ -0,0 +1,218 @@
+from bisect import bisect_left
+from timeit import default_timer
+
+
+OPERATIONS = ('insert', 'delete', 'search', 'other')
+COUNTERS = ('comparisons', 'depth', 'rotations', 'flips', 'make_red', 'swaps')
+# Upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3,
+           1e-2, 1e-1)
+
+# Engine methods counted as they are called.
+_COUNTED = {
+    '_rotate_left': 'rotations',
+    '_rotate_right': 'rotations',
+    '_flip_color': 'flips',
+    '_make_left_red': 'make_red',
+    '_make_right_red': 'make_red',
+    '_swap_nodes': 'swaps',
+}
+# Engine methods timed as one operation, with the position of their key.
+_TIMED = {
+    '_insert_key': ('insert', 0),
+    '_delete_key': ('delete', 0),
+    '_search': ('search', 1),
+}
+# Key types whose comparisons hand over to a _Probe.
+try:
+    _PROBED_TYPES = (int, long, float, str, unicode, bytes, tuple)
+except NameError:
+    _PROBED_TYPES = (int, float, str, bytes, tuple)
+
+
+class _Probe(object):
+    # Stands in for the key an operation looks for and counts how it is
+    # compared. The engine always writes node_key == key and node_key < key,
+    # which Python hands over to the probe as soon as the node key's own
+    # comparison returns NotImplemented, as those of the builtin types in
+    # _PROBED_TYPES do. Other keys may answer for themselves instead, so
+    # their operations run on the key as is and count neither comparisons
+    # nor depth.
+    #
+    # Every node on the way down is tested for equality once, which makes
+    # the number of those tests the depth of the descent. A delete that
+    # falls back to the top-down _delete descends a second time, after its
+    # lookup has found the key; only the lookup counts as depth.
+
+    __slots__ = ('key', 'counts_depth', '_stats')
+
+    def __init__(self, key, stats):
+        self.key = key
+        self.counts_depth = True
+        self._stats = stats
+
+    def __eq__(self, other):
+        if self.counts_depth:
+            self._stats._count('depth')
+        self._stats._count('comparisons')
+        return other == self.key
+
+    def __ne__(self, other):
+        self._stats._count('comparisons')
+        return other != self.key
+
+    def __gt__(self, other):
+        self._stats._count('comparisons')
+        return other < self.key
+
+    def __lt__(self, other):
+        self._stats._count('comparisons')
+        return self.key < other
+
+    __hash__ = None
+
+
+class TreeStats(object):
+    # What the operations of one tree have done since the stats were started:
+    # counters per operation (comparisons with the key looked for and nodes
+    # descended through, for keys of builtin types; rotations, color flips,
+    # _make_*_red calls, key swaps) and a latency histogram per operation.
+    # Work done outside insert, delete and search, like bulk loads and set
+    # operations, counts as 'other'.
+    #
+    # The stats live entirely in instance attributes that shadow the engine
+    # methods involved, as RBTreeModel does with its observers; a tree
+    # without stats runs the bare engine.
+
+    _operation = None
+    _counters = None
+    _buckets = None
+    _sums = None
+    _saved = None
+
+    def __init__(self):
+        self.reset()
+
+    def as_dict(self):
+        # {operation: {counter: value, 'count': operations, 'seconds': total
+        # time, 'buckets': [(upper bound, cumulative count), ...]}}
+        result = {}
+        for operation in OPERATIONS:
+            entry = dict((name, self._counters[operation, name])
+                         for name in COUNTERS)
+            counts = self._buckets[operation]
+            entry['count'] = sum(counts)
+            entry['seconds'] = self._sums[operation]
+            entry['buckets'] = [(bound, sum(counts[:index + 1]))
+                                for index, bound in enumerate(BUCKETS)]
+            result[operation] = entry
+        return result
+
+    def reset(self):
+        self._counters = dict(((operation, name), 0) for operation in OPERATIONS
+                              for name in COUNTERS)
+        self._buckets = dict((operation, [0] * (len(BUCKETS) + 1))
+                             for operation in OPERATIONS)
+        self._sums = dict((operation, 0.0) for operation in OPERATIONS)
+
+    def to_prometheus(self, prefix='rbtree'):
+        # The stats in the Prometheus text exposition format.
+        lines = []
+        stats = self.as_dict()
+        for name in COUNTERS:
+            metric = '%s_%s_total' % (prefix, name)
+            lines.append('# TYPE %s counter' % metric)
+            for operation in OPERATIONS:
+                lines.append('%s{operation="%s"} %d'
+                             % (metric, operation, stats[operation][name]))
+        metric = '%s_operation_seconds' % prefix
+        lines.append('# TYPE %s histogram' % metric)
+        for operation in OPERATIONS[:-1]:
+            entry = stats[operation]
+            for bound, count in entry['buckets']:
+                lines.append('%s_bucket{operation="%s",le="%r"} %d'
+                             % (metric, operation, bound, count))
+            lines.append('%s_bucket{operation="%s",le="+Inf"} %d'
+                         % (metric, operation, entry['count']))
+            lines.append('%s_sum{operation="%s"} %r'
+                         % (metric, operation, entry['seconds']))
+            lines.append('%s_count{operation="%s"} %d'
+                         % (metric, operation, entry['count']))
+        return '\n'.join(lines) + '\n'
+
+    ############################################################################
+
+    def install(self, tree):
+        # Shadows the engine methods of tree with counting ones, on top of
+        # whatever the instance shadows already.
+        names = list(_COUNTED) + list(_TIMED) + ['_delete', '_new_node']
+        self._saved = dict((name, tree.__dict__.get(name)) for name in names)
+        for name in _COUNTED:
+            setattr(tree, name, self._make_counted(_COUNTED[name], getattr(tree, name)))
+        for name, (operation, position) in _TIMED.items():
+            setattr(tree, name, self._make_timed(operation, position,
+                                                 getattr(tree, name)))
+        tree._delete = self._make_redescent(tree._delete)
+        tree._new_node = self._make_unwrapped(tree._new_node)
+
+    def uninstall(self, tree):
+        # Puts back the instance attributes install() found.
+        for name, method in self._saved.items():
+            if method is None:
+                tree.__dict__.pop(name, None)
+            else:
+                setattr(tree, name, method)
+        self._saved = None
+
+    ############################################################################
+
+    def _count(self, name):
+        self._counters[self._operation or 'other', name] += 1
+
+    def _make_counted(self, name, method):
+        count = self._count
+
+        def counted(*args):
+            count(name)
+            return method(*args)
+        return counted
+
+    def _make_redescent(self, method):
+        # The top-down delete goes down again to a key already found.
+        def delete(node, key):
+            if type(key) is _Probe:
+                key.counts_depth = False
+            return method(node, key)
+        return delete
+
+    def _make_timed(self, operation, position, method):
+        stats = self
+
+        def timed(*args):
+            if stats._operation is not None:
+                # Part of an operation already timed, like the search in
+                # PersistentRedBlackTree._delete_key.
+                return method(*args)
+            if type(args[position]) in _PROBED_TYPES:
+                args = list(args)
+                args[position] = _Probe(args[position], stats)
+            stats._operation = operation
+            start = default_timer()
+            try:
+                return method(*args)
+            finally:
+                stats._observe(default_timer() - start)
+                stats._operation = None
+        return timed
+
+    def _make_unwrapped(self, method):
+        # Nodes get the key itself, never the probe.
+        def new_node(key, path):
+            if type(key) is _Probe:
+                key = key.key
+            return method(key, path)
+        return new_node
+
+    def _observe(self, seconds):
+        self._buckets[self._operation][bisect_left(BUCKETS, seconds)] += 1
+        self._sums[self._operation] += seconds
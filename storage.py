@@ -0,0 +1,269 @@
+import mmap
+import struct
+import sys
+from array import array
+
+from rbtree import RedBlackTree, RED, BLACK
+from rbmap import RedBlackTreeMap
+
+try:
+    _int_types = (int, long)
+    _text_type = unicode
+except NameError:
+    _int_types = (int,)
+    _text_type = str
+
+
+# Binary layout, little-endian throughout, nodes in preorder:
+#
+#   header   magic, key kind, node count, size of the string data
+#   keys     int64 or float64 per node; for text and byte strings,
+#            count + 1 uint64 offsets into the string data
+#   rights   uint32 per node: index of the right child, 0 for none (the
+#            root is node 0, so it is never anyone's child)
+#   flags    uint8 per node: _RED_FLAG, _LEFT_FLAG
+#   strings  keys back to back, if any: text as utf-8, bytes as they are
+#
+# A node's left child, if it has one, is always the next node.
+_MAGIC = b'RBT\x01'
+_HEADER = struct.Struct('<4s4sQQ')
+_KEY_FORMATS = {b'q': 'q', b'd': 'd', b's': 'Q', b'b': 'Q'}
+_STRING_KINDS = (b's', b'b')
+_INT64_MIN = -1 << 63
+_INT64_MAX = (1 << 63) - 1
+_RIGHT = struct.Struct('<I')
+_FLAG = struct.Struct('<B')
+_RED_FLAG = 1
+_LEFT_FLAG = 2
+
+
+def dump(tree, stream):
+    # Writes the keys and shape of tree to a binary stream. Keys must all be
+    # int64 ints, all floats, all text strings or all byte strings (plain str
+    # on Python 2); trees with a key function or values cannot be dumped.
+    # load() gives back keys of the same type.
+    if tree._key_func is not None or isinstance(tree, RedBlackTreeMap):
+        raise TypeError('only plain key trees can be dumped')
+    count = len(tree)
+    if count >= 1 << 32:
+        raise ValueError('too many keys')
+    rights = array('I', [0]) * count
+    flags = bytearray(count)
+    keys = []
+    stack = [(tree._root, None)] if tree._root is not None else []
+    while stack:
+        node, parent = stack.pop()
+        index = len(keys)
+        if parent is not None:
+            rights[parent] = index
+        keys.append(node._key)
+        flags[index] = (_RED_FLAG if node._color == RED else 0) | (
+            _LEFT_FLAG if node._left is not None else 0)
+        if node._right is not None:
+            stack.append((node._right, index))
+        if node._left is not None:
+            stack.append((node._left, None))
+    kind = _get_kind(keys)
+    strings = b''
+    if kind in _STRING_KINDS:
+        encoded = ([key.encode('utf-8') for key in keys] if kind == b's'
+                   else keys)
+        offsets = [0]
+        for key in encoded:
+            offsets.append(offsets[-1] + len(key))
+        keys, strings = offsets, b''.join(encoded)
+    stream.write(_HEADER.pack(_MAGIC, kind, count, len(strings)))
+    stream.write(_get_key_struct(kind, len(keys)).pack(*keys))
+    _write_array(stream, rights)
+    stream.write(bytes(flags))
+    stream.write(strings)
+
+
+def load(stream, tree_class=RedBlackTree):
+    # Reads a tree written by dump() back into a tree_class, node for node.
+    kind, count, string_size = _read_header(stream.read(_HEADER.size))
+    key_struct = _get_key_struct(kind, count + (kind in _STRING_KINDS))
+    keys = key_struct.unpack(stream.read(key_struct.size))
+    rights = _read_array(stream, 'I', count)
+    flags = bytearray(stream.read(count))
+    if kind in _STRING_KINDS:
+        strings = stream.read(string_size)
+        keys = [strings[keys[index]:keys[index + 1]] for index in range(count)]
+        if kind == b's':
+            keys = [key.decode('utf-8') for key in keys]
+    tree = tree_class()
+    nodes = [tree.Node(key) for key in keys]
+    for index, node in enumerate(nodes):
+        flag = flags[index]
+        node._color = RED if flag & _RED_FLAG else BLACK
+        if flag & _LEFT_FLAG:
+            node._left = nodes[index + 1]
+        if rights[index]:
+            node._right = nodes[rights[index]]
+    tree._adopt(nodes[0] if nodes else None, count)
+    return tree
+
+
+def _get_key_struct(kind, count):
+    # Keys go through struct rather than array, which has no 8-byte integer
+    # typecodes before Python 3.3.
+    return struct.Struct('<%d%s' % (count, _KEY_FORMATS[kind]))
+
+
+def _get_kind(keys):
+    if all(type(key) in _int_types for key in keys):
+        if keys and (min(keys) < _INT64_MIN or max(keys) > _INT64_MAX):
+            raise ValueError('keys out of int64 range')
+        return b'q'
+    if all(type(key) is float for key in keys):
+        return b'd'
+    if all(isinstance(key, _text_type) for key in keys):
+        return b's'
+    if all(isinstance(key, bytes) for key in keys):
+        return b'b'
+    raise TypeError('keys must be all ints, all floats, all text strings or '
+                    'all byte strings')
+
+
+def _read_array(stream, typecode, count):
+    values = array(typecode)
+    data = stream.read(values.itemsize * count)
+    if str is bytes:
+        values.fromstring(data)
+    else:
+        values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def _read_header(data):
+    magic, kind, count, string_size = _HEADER.unpack(data)
+    if magic != _MAGIC or kind[:1] not in _KEY_FORMATS:
+        raise ValueError('not a dumped tree')
+    return kind[:1], count, string_size
+
+
+def _write_array(stream, values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    stream.write(values.tostring() if str is bytes else values.tobytes())
+
+
+class MappedTree(object):
+    # A dumped tree opened read-only through mmap. Opening only reads the
+    # header; searches and scans then decode just the nodes they visit, so
+    # the cost of a cold start does not depend on the size of the tree.
+
+    _file = None
+    _map = None
+    _count = 0
+    _kind = None
+    _key = None
+    _keys = 0
+    _rights = 0
+    _flags = 0
+    _strings = 0
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty tree may be too short to map on some platforms.
+            self._map = self._file.read()
+        self._kind, self._count, string_size = _read_header(
+            self._map[:_HEADER.size])
+        self._key = struct.Struct('<' + _KEY_FORMATS[self._kind])
+        self._keys = _HEADER.size
+        self._rights = self._keys + self._key.size * (
+            self._count + (self._kind in _STRING_KINDS))
+        self._flags = self._rights + _RIGHT.size * self._count
+        self._strings = self._flags + self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return self._scan(None, None, False)
+
+    def __len__(self):
+        return self._count
+
+    def __reversed__(self):
+        return self._scan(None, None, True)
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def max(self):
+        return next(self._scan(None, None, True), None)
+
+    def min(self):
+        return next(self._scan(None, None, False), None)
+
+    def range(self, lo, hi):
+        # Both bounds are inclusive, as in RedBlackTree.range.
+        return self._scan(lo, hi, False)
+
+    def search(self, key):
+        index = 0 if self._count else None
+        while index is not None:
+            node_key = self._get_key(index)
+            if node_key == key:
+                return True
+            index = (self._get_right(index) if node_key < key
+                     else self._get_left(index))
+        return False
+
+    ############################################################################
+
+    def _get_key(self, index):
+        if self._kind not in _STRING_KINDS:
+            return self._key.unpack_from(self._map, self._keys + self._key.size * index)[0]
+        start, end = struct.unpack_from('<QQ', self._map, self._keys + 8 * index)
+        key = self._map[self._strings + start:self._strings + end]
+        return key.decode('utf-8') if self._kind == b's' else key
+
+    def _get_left(self, index):
+        flags = _FLAG.unpack_from(self._map, self._flags + index)[0]
+        return index + 1 if flags & _LEFT_FLAG else None
+
+    def _get_right(self, index):
+        right = _RIGHT.unpack_from(self._map, self._rights + _RIGHT.size * index)[0]
+        return right or None
+
+    def _scan(self, lo, hi, reverse):
+        # RedBlackTree._scan over node indices.
+        stack = []
+        index = 0 if self._count else None
+        while True:
+            while index is not None:
+                key = self._get_key(index)
+                if reverse:
+                    if hi is not None and hi < key:
+                        index = self._get_left(index)
+                    else:
+                        stack.append((index, key))
+                        index = self._get_right(index)
+                else:
+                    if lo is not None and key < lo:
+                        index = self._get_right(index)
+                    else:
+                        stack.append((index, key))
+                        index = self._get_left(index)
+            if not stack:
+                return
+            index, key = stack.pop()
+            if reverse:
+                if lo is not None and key < lo:
+                    return
+            elif hi is not None and hi < key:
+                return
+            yield key
+            index = self._get_left(index) if reverse else self._get_right(index)
@@ -1,186 +1,433 @@
+from collections import OrderedDict
 from math import sqrt
 from sys import stderr
 
+from animation import RBTreeAnimator, Transition
+from layout import (CIRCLE_RADIUS, GLYPH_LABEL_HEIGHT, MIN_SPACING, PEN_WEIGHT,
+                    ROW_DISTANCE, get_detail_row, get_glyph_label, get_glyph_shape,
+                    get_layout, get_parent_slot, get_row_span, summarize)
 from model import RED, BLACK
 
 from PySide import QtGui, QtCore
 from PySide.QtCore import Qt
 
 
-_CIRCLE_RADIUS = 12
-_ROW_DISTANCE = 50
+_REFRESH_DELAY = 30
+
+_LABEL_CACHE_SIZE = 4096
 
 _LINE_Z_VALUE = 1
 _CIRCLE_Z_VALUE = 2
 _TEXT_Z_VALUE = 3
 
-_PEN_WEIGHT = 2
+# Distinct line colors a red/black fade goes through.
+_FADE_STEPS = 32
+
+
+class _LabelCache(object):
+    # Label text -> (font, position of the text item relative to the circle
+    # centre). Least recently used entries are evicted first.
+
+    _size = None
+    _entries = None
+
+    def __init__(self, size):
+        self._size = size
+        self._entries = OrderedDict()
+
+    def get(self, text, fit):
+        entry = self._entries.pop(text, None)
+        if entry is None:
+            entry = fit(text)
+            if len(self._entries) >= self._size:
+                self._entries.popitem(last=False)
+        self._entries[text] = entry
+        return entry
+
 
 class RBTreeView(object):
 
     _app = None
     _canvas = None
     _nodes = None
+    _dirty = None
+    _detail = None
+    _glyphs = None
+    _animator = None
+    _refresh_timer = None
     _black_pen = None
     _red_pen = None
 
 
+    class Detail(object):
+        # What of the drawn tree gets graphics items: nodes above the first
+        # row too dense to tell apart at the current zoom, and only near the
+        # visible part of the scene. Lives in the GUI thread.
+
+        _slots = None
+        _visible = None
+        _rows = None
+        # row -> {col: (node count, black height)} of the subtrees glyphs
+        # were drawn for; place() drops those of the subtrees it changes.
+        _summaries = None
+        _row = 0
+        _width = 0.0
+        _layout = get_layout(0.0)
+        _rect = (0.0, 0.0, 0.0, 0.0)
+        _stale = False
+
+        def __init__(self):
+            self._slots = {}
+            self._visible = {}
+            self._rows = {}
+            self._summaries = {}
+
+        def contains(self, slot):
+            if slot[0] >= self._row:
+                return False
+            return self._in_rect(slot) or self._in_rect(get_parent_slot(slot))
+
+        def get_candidates(self):
+            # Every node that may have to gain or lose its items.
+            nodes = dict(self._visible)
+            left, top, right, bottom = self._rect
+            for row in range(self._row):
+                # Children hang up to a slot's width beside their parent.
+                margin = self._width / (1 << row)
+                first, last = get_row_span(row, self._width, left - margin,
+                                           right + margin)
+                for col in range(first, last + 1):
+                    node = self._slots.get((row, col))
+                    if node is not None:
+                        nodes[id(node)] = node
+            return list(nodes.values())
+
+        def get_coord(self, slot):
+            return self._layout.get_coord(slot)
+
+        def get_depth(self):
+            return max(self._rows) + 1 if self._rows else 0
+
+        def get_glyphs(self):
+            # (slot, color, node count, black height) of every subtree drawn
+            # as a glyph in view.
+            self._stale = False
+            left, top, right, bottom = self._rect
+            glyphs = []
+            row = self._row
+            if row not in self._rows:
+                return glyphs
+            summaries = self._summaries.setdefault(row, {})
+            first, last = get_row_span(row, self._width, left, right)
+            for col in range(first, last + 1):
+                node = self._slots.get((row, col))
+                if node is None:
+                    continue
+                summary = summaries.get(col)
+                if summary is None:
+                    summary = summaries[col] = summarize(node, self._get_children)
+                glyphs.append(((row, col), node.get_color()) + summary)
+            return glyphs
+
+        def get_row(self):
+            return self._row
+
+        def is_stale(self):
+            return self._stale
+
+        def place(self, node, old, new):
+            # Moves node from slot old to slot new; None for off the scene.
+            if old is not None:
+                self._forget(old)
+                if self._slots.get(old) is node:
+                    del self._slots[old]
+                self._rows[old[0]] -= 1
+                if not self._rows[old[0]]:
+                    del self._rows[old[0]]
+                self._stale = self._stale or old[0] >= self._row
+            if new is not None:
+                self._forget(new)
+                self._slots[new] = node
+                self._rows[new[0]] = self._rows.get(new[0], 0) + 1
+                self._stale = self._stale or new[0] >= self._row
+
+        def set_visible(self, node, visible):
+            if visible:
+                self._visible[id(node)] = node
+            else:
+                self._visible.pop(id(node), None)
+
+        def update(self, width, scale, rect):
+            # Returns whether slot coordinates changed, i.e. the width.
+            relayout = width != self._width
+            self._width = width
+            self._layout = get_layout(width)
+            self._row = get_detail_row(width, scale, MIN_SPACING)
+            margin = CIRCLE_RADIUS / scale
+            left, top, right, bottom = rect
+            self._rect = (left - margin, top - margin, right + margin,
+                          bottom + margin)
+            self._stale = True
+            return relayout
+
+        def _forget(self, slot):
+            # Drops the summaries of the subtrees slot lies in.
+            row, col = slot
+            for summary_row, summaries in self._summaries.items():
+                if summary_row <= row:
+                    summaries.pop(col >> (row - summary_row), None)
+
+        def _get_children(self, node):
+            row, col = node.get_slot()
+            return (self._slots.get((row + 1, col * 2)),
+                    self._slots.get((row + 1, col * 2 + 1)))
+
+        def _in_rect(self, slot):
+            if slot is None:
+                return False
+            left, top, right, bottom = self._rect
+            x, y = self._layout.get_coord(slot)
+            return left <= x <= right and top <= y <= bottom
+
+
     class Node(object):
+        # The model side (hooks, take_state) runs in whichever thread drives
+        # the model; everything that touches graphics items runs in the GUI
+        # thread, from the transitions the animator plays.
+
+        # Shared by all nodes: label sizing only depends on the text, and a
+        # color fade only ever goes between the two pens.
+        _labels = _LabelCache(_LABEL_CACHE_SIZE)
+        _fade_pens = {}
 
         _canvas = None
+        _detail = None
+        _dirty = None
         _pen = None
         _default_pen = None
         _back_brush = None
         _fore_brush = None
         _model_node = None
 
-        _old_slot = None
-        _old_color = None
-        _old_key = None
+        _state = None
+        _to_delete = None
+
+        _drawn = None
+        _move = None
+        _motion = None
+        _fade = None
 
         _line = None
         _circle = None
         _text = None
 
-        _to_delete = None
-
-        def __init__(self, canvas, black_pen, red_pen, model_node):
+        def __init__(self, canvas, black_pen, red_pen, model_node, detail,
+                     dirty):
+            # dirty is shared by all nodes of a view: the hooks add the node
+            # to it, take_state takes it out again.
             self._canvas = canvas
+            self._detail = detail
+            self._dirty = dirty
             self._pen = {RED: red_pen, BLACK: black_pen}
             self._default_pen = black_pen
             self._back_brush = QtGui.QBrush(Qt.white)
             self._fore_brush = QtGui.QBrush(Qt.black)
             self._model_node = model_node
             self._model_node.update_hooks({
-                'before_slot_changed': self._before_slot_changed,
-                'before_color_changed': self._before_color_changed,
-                'before_key_changed': self._before_key_changed,
+                'before_slot_changed': self._before_change,
+                'before_color_changed': self._before_change,
+                'before_key_changed': self._before_change,
                 'before_delete': self._before_delete,
             })
-            self._line = QtGui.QGraphicsLineItem(parent=None, scene=self._canvas)
-            self._circle = QtGui.QGraphicsEllipseItem(parent=None, scene=self._canvas)
-            self._text = QtGui.QGraphicsTextItem(parent=None, scene=self._canvas)
-            self.draw()
             self._to_delete = False
 
+        ########################################################################
+        # Model side
+
+        def get_model_node(self):
+            return self._model_node
+
+        def is_changed(self):
+            return id(self) in self._dirty
+
+        def is_deleted(self):
+            return self._to_delete
+
+        def take_state(self):
+            # Returns the state the last transition left the node in and the
+            # one it has now; the latter is what the next transition is for.
+            old = self._state
+            if self._to_delete:
+                self._state = None
+            else:
+                model_node = self._model_node
+                self._state = (model_node.get_slot(), model_node.get_color(),
+                               model_node.get_key())
+            self._dirty.pop(id(self), None)
+            return old, self._state
+
         ########################################################################
         # Representation related methods
 
+        # A node on the scene has a drawn state, but graphics items only while
+        # the level of detail shows it; circles and labels keep their size on
+        # screen at any zoom, only positions scale.
+
         def draw(self):
-            slot = self._model_node.get_slot()
+            slot, color, key = self._drawn
             node_point = self._get_slot_coord(slot)
             parent_slot = self._get_parent_slot(slot)
             parent_point = self._get_slot_coord(parent_slot)
             # Draw line
             self._line.setLine(*(list(node_point) + list(parent_point)))
-            self._line.setPen(self._pen[self._model_node.get_color()])
+            self._line.setPen(self._pen[color])
             self._line.setZValue(_LINE_Z_VALUE)
             # Draw circle
-            self._circle.setRect(*self._get_circle_rect(*node_point))
+            self._circle.setRect(*self._get_circle_rect(0, 0))
+            self._circle.setPos(*node_point)
             self._circle.setPen(self._default_pen)
             self._circle.setBrush(self._back_brush)
             self._circle.setZValue(_CIRCLE_Z_VALUE)
             # Draw text
-            self._text.setPlainText(str(self._model_node.get_key()))
             self._text.setParentItem(self._circle)
             self._text.setZValue(_TEXT_Z_VALUE)
-            self._adjust_font()
-            self._text.setPos(*self._get_text_coord(*node_point))
-
-        def delete(self):
-            if self._to_delete:
-                for item in (self._circle, self._line):
-                    item.setParentItem(None)
-                    item.hide()
-                    self._canvas.removeItem(item)
-                return self
-
-        def start_move(self):
-            if self._old_slot is not None:
-                # Calculate slots and coords
-                old_slot = self._old_slot
-                new_slot = self._model_node.get_slot()
-                old_parent_slot = self._get_parent_slot(old_slot)
-                new_parent_slot = self._get_parent_slot(new_slot)
-                self._old_node_coord = self._get_slot_coord(old_slot)
-                self._new_node_coord = self._get_slot_coord(new_slot)
-                self._old_parent_coord = self._get_slot_coord(old_parent_slot)
-                self._new_parent_coord = self._get_slot_coord(new_parent_slot)
-            if self._old_color is not None:
-                self._old_color_map = self._pen[self._old_color].color().getRgbF()[:3]
-                self._new_color_map = self._pen[self._model_node.get_color()].color().getRgbF()[:3]
-
-        def step(self, ratio):
-            if self._old_slot is not None:
-                begin1, begin2 = self._old_node_coord, self._new_node_coord
-                end1, end2 = self._old_parent_coord, self._new_parent_coord
-
-                begin = tuple(map(lambda x, y: x + (y - x) * ratio, begin1, begin2))
-                end = tuple(map(lambda x, y: x + (y - x) * ratio, end1, end2))
-
-                self._circle.setRect(*self._get_circle_rect(*begin))
-                self._line.setLine(*(list(begin) + list(end)))
-                self._text.setPos(*self._get_text_coord(*begin))
-            if self._old_color is not None:
-                color = tuple(map(lambda x, y: x + (y - x) * ratio, self._old_color_map,
-                                  self._new_color_map))
-                qcolor = QtGui.QColor()
-                qcolor.setRgbF(*color)
-                self._line.setPen(QtGui.QPen(qcolor, _PEN_WEIGHT))
+            self._set_label(key)
+
+        def get_color(self):
+            return self._drawn[1]
+
+        def get_slot(self):
+            return self._drawn[0]
+
+        def hide(self):
+            self._remove_items()
+            self._detail.place(self, self._drawn[0], None)
+            self._drawn = None
+
+        def redraw(self, relayout):
+            # Follows a change of the level of detail; relayout for a change
+            # of the slot coordinates themselves.
+            self._sync(relayout)
+
+        def show(self, state):
+            self._drawn = state
+            self._detail.place(self, None, state[0])
+            self._sync(True)
+
+        def start_move(self, old, new):
+            # The transition interpolates the motion itself, for all moving
+            # nodes at once; see get_motion and set_frame.
+            old_slot, old_color, old_key = old
+            new_slot, new_color, new_key = new
+            self._move = new
+            self._motion = self._fade = None
+            if self._line is None:
+                return
+            if old_key != new_key:
+                self._update_key(new_key)
+            if old_slot != new_slot:
+                self._motion = (
+                    self._get_slot_coord(old_slot) +
+                    self._get_slot_coord(self._get_parent_slot(old_slot)),
+                    self._get_slot_coord(new_slot) +
+                    self._get_slot_coord(self._get_parent_slot(new_slot)))
+            if old_color != new_color:
+                self._fade = (old_color, new_color, None)
+
+        def fade(self, ratio):
+            if self._line is None or self._fade is None:
+                return
+            old_color, new_color, level = self._fade
+            new_level = int(ratio * _FADE_STEPS + 0.5)
+            if new_level != level:
+                self._fade = (old_color, new_color, new_level)
+                self._line.setPen(
+                    self._get_fade_pen(old_color, new_color, new_level))
+
+        def get_motion(self):
+            # ((x, y, parent x, parent y) before, the same after) or None.
+            return self._motion
+
+        def is_fading(self):
+            return self._fade is not None
+
+        def set_frame(self, x, y, parent_x, parent_y):
+            if self._motion is not None:
+                self._circle.setPos(x, y)
+                self._line.setLine(x, y, parent_x, parent_y)
 
         def finish_move(self):
-            self._old_slot = None
-            if self._old_color is not None:
-                self._old_color = None
-                del self._old_color_map
-                del self._new_color_map
-
-        ########################################################################
-
-        def get_key_update_action(self):
-            if self._old_key is not None:
-                return self._update_key
-
-        def need_graphics_update(self):
-            return (self._old_slot is not None) or (self._old_color is not None)
+            self._detail.place(self, self._drawn[0], self._move[0])
+            self._drawn, self._move = self._move, None
+            self._sync(True)
 
         ########################################################################
         # Hooks
 
-        def _before_color_changed(self):
-            self._old_color = self._model_node.get_color()
+        # The state a node is animated from is the one the previous
+        # transition left it in, so a batch of model operations is animated
+        # from where it started.
 
-        def _before_key_changed(self):
-            self._old_key = self._model_node.get_key()
-
-        def _before_slot_changed(self):
-            self._old_slot = self._model_node.get_slot()
+        def _before_change(self):
+            self._dirty[id(self)] = self
 
         def _before_delete(self):
             self._to_delete = True
+            self._dirty[id(self)] = self
 
         ########################################################################
 
         def _get_parent_slot(self, slot):
-            if slot is None or slot == (0, 0):
-                return None
-            return (slot[0] - 1, slot[1] >> 1)
-
-        def _update_key(self):
-            self._text.setPlainText(str(self._model_node.get_key()))
-            self._adjust_font()
-            self._old_key = None
+            return get_parent_slot(slot)
+
+        def _remove_items(self):
+            if self._line is None:
+                return
+            for item in (self._circle, self._line):
+                item.setParentItem(None)
+                item.hide()
+                self._canvas.removeItem(item)
+            self._line = self._circle = self._text = None
+            self._motion = self._fade = None
+            self._detail.set_visible(self, False)
+
+        def _sync(self, redraw):
+            if not self._detail.contains(self._drawn[0]):
+                self._remove_items()
+                return
+            if self._line is None:
+                self._line = QtGui.QGraphicsLineItem(parent=None, scene=self._canvas)
+                self._circle = QtGui.QGraphicsEllipseItem(parent=None, scene=self._canvas)
+                self._circle.setFlag(QtGui.QGraphicsItem.ItemIgnoresTransformations)
+                self._text = QtGui.QGraphicsTextItem(parent=None, scene=self._canvas)
+                self._motion = self._fade = None
+                self._detail.set_visible(self, True)
+                redraw = True
+            if redraw:
+                self.draw()
+
+        def _update_key(self, key):
+            self._set_label(key)
 
         ########################################################################
         # Font manipulation methods
 
-        def _adjust_font(self):
-            font = self._text.font()
-            while self._text_fits_circle(font):
+        def _fit_label(self, text):
+            # The largest font the text fits the circle with, and where the
+            # text item goes with it.
+            font = QtGui.QFont(self._text.font())
+            while self._text_fits_circle(font, text):
                 font = self._change_font_size(font, 1)
-            while not self._text_fits_circle(font):
+            while not self._text_fits_circle(font, text):
                 font = self._change_font_size(font, -1)
+            return font, self._get_text_coord(0, 0, font, text)
+
+        def _set_label(self, key):
+            text = str(key)
+            font, position = self._labels.get(text, self._fit_label)
+            self._text.setPlainText(text)
             self._text.setFont(font)
+            self._text.setPos(*position)
 
         def _change_font_size(self, font, delta):
             size = font.pixelSize()
@@ -195,36 +442,38 @@ class RBTreeView(object):
                 font.setPointSize(size)
             return font
 
-        def _text_fits_circle(self, font):
+        def _text_fits_circle(self, font, text):
             metrics = QtGui.QFontMetrics(font)
-            diagonal = sqrt(metrics.height() ** 2 + metrics.width(self._text.toPlainText()) ** 2)
-            return diagonal <= (_CIRCLE_RADIUS * 2)
+            diagonal = sqrt(metrics.height() ** 2 + metrics.width(text) ** 2)
+            return diagonal <= (CIRCLE_RADIUS * 2)
 
         ########################################################################
         # Graphics calculation methods
 
         def _get_circle_rect(self, cx, cy):
-            diameter = _CIRCLE_RADIUS << 1
-            return cx - _CIRCLE_RADIUS, cy - _CIRCLE_RADIUS, diameter, diameter
+            diameter = CIRCLE_RADIUS << 1
+            return cx - CIRCLE_RADIUS, cy - CIRCLE_RADIUS, diameter, diameter
 
-        def _get_text_coord(self, cx, cy):
-            metrics = QtGui.QFontMetrics(self._text.font())
-            return (cx - metrics.width(self._text.toPlainText()) / 2 - _CIRCLE_RADIUS * 0.3,
-                    cy - metrics.height() / 2 - _CIRCLE_RADIUS * 0.3)
+        def _get_text_coord(self, cx, cy, font, text):
+            metrics = QtGui.QFontMetrics(font)
+            return (cx - metrics.width(text) / 2 - CIRCLE_RADIUS * 0.3,
+                    cy - metrics.height() / 2 - CIRCLE_RADIUS * 0.3)
+
+        def _get_fade_pen(self, old_color, new_color, level):
+            pen = self._fade_pens.get((old_color, new_color, level))
+            if pen is None:
+                ratio = float(level) / _FADE_STEPS
+                old = self._pen[old_color].color().getRgbF()[:3]
+                new = self._pen[new_color].color().getRgbF()[:3]
+                color = QtGui.QColor()
+                color.setRgbF(*[a + (b - a) * ratio for a, b in zip(old, new)])
+                pen = QtGui.QPen(color, PEN_WEIGHT)
+                pen.setCosmetic(True)
+                self._fade_pens[(old_color, new_color, level)] = pen
+            return pen
 
         def _get_slot_coord(self, slot):
-            if slot == None:
-                return (self._get_slot_coord((0, 0))[0], 0.0)
-            y = (slot[0] + 1.0) * _ROW_DISTANCE
-            level_width = self._canvas.width() / 2.0
-            x = level_width
-            if slot[0]:
-                side_markers = bin(slot[1])[2:]
-                side_markers = '0' * (slot[0] - len(side_markers)) + side_markers
-                for item in side_markers:
-                    level_width /= 2.0
-                    x += (-level_width, level_width)[int(item)]
-            return (x, y)
+            return self._detail.get_coord(slot)
 
     ############################################################################
 
@@ -234,53 +483,123 @@ class RBTreeView(object):
         self._canvas = gui.get_canvas()
         self._canvas.setSceneRect(0, 0, self._canvas.width(), self._canvas.height())
         gui.canvasResized.connect(self._handle_resize)
-        self._nodes = []
-        self._black_pen = QtGui.QPen(Qt.black, _PEN_WEIGHT)
-        self._red_pen = QtGui.QPen(Qt.red, _PEN_WEIGHT)
+        gui.graph_view.viewChanged.connect(self._schedule_refresh)
+        # id(model node) -> view node, and the view nodes the model hooks
+        # touched since they last went into a transition.
+        self._nodes = {}
+        self._dirty = {}
+        self._detail = self.Detail()
+        self._glyphs = []
+        self._animator = RBTreeAnimator()
+        self._animator.finished.connect(self._refresh_glyphs)
+        self._refresh_timer = QtCore.QTimer()
+        self._refresh_timer.setSingleShot(True)
+        self._refresh_timer.setInterval(_REFRESH_DELAY)
+        self._refresh_timer.timeout.connect(self._refresh)
+        self._black_pen = QtGui.QPen(Qt.black, PEN_WEIGHT)
+        self._black_pen.setCosmetic(True)
+        self._red_pen = QtGui.QPen(Qt.red, PEN_WEIGHT)
+        self._red_pen.setCosmetic(True)
+        self._refresh()
+
+    # The methods below are driven by the model hooks and may run in a worker
+    # thread: they only capture what changed into a transition and queue it.
 
     def add_node(self, model_node):
-        view_node = self.Node(self._canvas, self._black_pen,
-                              self._red_pen, model_node)
-        self._nodes.append(view_node)
-        self._app.processEvents()
-        QtCore.QThread.msleep(1000)
+        self.add_nodes((model_node,))
+
+    def add_nodes(self, model_nodes):
+        transition = Transition()
+        for model_node in model_nodes:
+            view_node = self.Node(self._canvas, self._black_pen,
+                                  self._red_pen, model_node, self._detail,
+                                  self._dirty)
+            self._nodes[id(model_node)] = view_node
+            transition.add(view_node, *view_node.take_state())
+        self._animator.enqueue(transition)
 
     def delete_node(self):
-        for node in self._nodes:
-            node = node.delete()
-            if node:
-                self._nodes.remove(node)
-                QtCore.QThread.msleep(1000)
+        deleted = [node for node in self._dirty.values() if node.is_deleted()]
+        if deleted:
+            self._animator.enqueue(self._take_changes(deleted))
+
+    def get_animator(self):
+        return self._animator
+
+    def get_node(self, model_node):
+        return self._nodes.get(id(model_node))
+
+    def set_speed(self, speed):
+        self._animator.set_speed(speed)
 
     def visualize_changes(self):
-        text_changes = filter(lambda x: x is not None,
-            map(lambda x: x.get_key_update_action(), self._nodes))
-        if text_changes:
-            for item in text_changes:
-                item()
-            self._canvas.update()
-            self._app.processEvents()
-
-        nodes_to_graphics_update = filter(lambda x: x.need_graphics_update(), self._nodes)
-        if nodes_to_graphics_update:
-            QtCore.QThread.msleep(1000)
-            map(lambda x: x.start_move(), nodes_to_graphics_update)
-            for i in xrange(51):
-                map(lambda x: x.step(i / 50.0), nodes_to_graphics_update)
-                QtCore.QThread.msleep(20)
-                self._canvas.update()
-                self._app.processEvents()
-            map(lambda x: x.finish_move(), nodes_to_graphics_update)
-            QtCore.QThread.msleep(50)
-            self._app.processEvents()
+        if self._dirty:
+            self._animator.enqueue(self._take_changes(list(self._dirty.values())))
+
+    def _take_changes(self, nodes):
+        transition = Transition()
+        for node in nodes:
+            if node.is_deleted():
+                del self._nodes[id(node.get_model_node())]
+            transition.add(node, *node.take_state())
+        return transition
 
     ############################################################################
 
     def _handle_resize(self, *args):
         self._canvas.setSceneRect(0, 0, self._gui.graph_view.width(),
                                   self._gui.graph_view.height())
-        self._repaint_all()
-
-    def _repaint_all(self):
-        map(lambda x: x.draw(), self._nodes)
-
+        self._refresh()
+
+    def _schedule_refresh(self):
+        # Zooming and panning come in bursts; lay out once they settle.
+        self._refresh_timer.start()
+
+    def _refresh(self):
+        graph_view = self._gui.graph_view
+        rect = graph_view.mapToScene(graph_view.viewport().rect()).boundingRect()
+        relayout = self._detail.update(
+            self._canvas.width(), graph_view.transform().m11(),
+            (rect.left(), rect.top(), rect.right(), rect.bottom()))
+        candidates = self._detail.get_candidates()
+        if relayout:
+            # One batch for every coordinate the redraw below asks for.
+            slots = [node.get_slot() for node in candidates]
+            slots.extend(get_parent_slot(slot) for slot in list(slots))
+            get_layout(self._canvas.width()).prepare(
+                [slot for slot in slots if slot is not None])
+        for node in candidates:
+            node.redraw(relayout)
+        self._refresh_glyphs()
+
+    def _refresh_glyphs(self):
+        if not self._detail.is_stale():
+            return
+        for item in self._glyphs:
+            self._canvas.removeItem(item)
+        self._glyphs = []
+        scale = self._gui.graph_view.transform().m11()
+        width = self._canvas.width()
+        height = (self._detail.get_depth() + 1) * ROW_DISTANCE
+        for slot, color, count, black_height in self._detail.get_glyphs():
+            points, label_pos = get_glyph_shape(slot, width, scale)
+            triangle = QtGui.QPolygonF([QtCore.QPointF(*point) for point in points])
+            glyph = self._canvas.addPolygon(triangle, self._black_pen,
+                                            QtGui.QBrush(Qt.lightGray))
+            glyph.setZValue(_CIRCLE_Z_VALUE)
+            self._glyphs.append(glyph)
+            line = self._canvas.addLine(QtCore.QLineF(
+                QtCore.QPointF(*points[0]),
+                QtCore.QPointF(*self._detail.get_coord(get_parent_slot(slot)))))
+            line.setPen(self._red_pen if color == RED else self._black_pen)
+            line.setZValue(_LINE_Z_VALUE)
+            self._glyphs.append(line)
+            if label_pos is not None:
+                label = self._canvas.addSimpleText(get_glyph_label(count, black_height))
+                label.setFlag(QtGui.QGraphicsItem.ItemIgnoresTransformations)
+                label.setPos(*label_pos)
+                height = max(height, label_pos[1] + GLYPH_LABEL_HEIGHT / scale)
+                label.setZValue(_TEXT_Z_VALUE)
+                self._glyphs.append(label)
+        if height > self._canvas.height():
+            self._canvas.setSceneRect(0, 0, width, height)